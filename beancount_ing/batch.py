@@ -0,0 +1,170 @@
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+from typing import Iterable, Optional
+
+from beancount.core import data
+from beangulp.extract import HEADER
+
+from .writer import format_entry
+
+
+# rough per-entry memory cost on top of the rendered text (tuple, key, date)
+_RECORD_OVERHEAD = 256
+
+
+def _sort_key(entry, filepath):
+    # date, then account, then the order beancount uses for directives of the
+    # same day (balance assertions first), then source position
+    if isinstance(entry, data.Transaction):
+        account = entry.postings[0].account if entry.postings else ""
+    else:
+        account = getattr(entry, "account", "")
+
+    return (
+        entry.date,
+        account,
+        data.SORT_ORDER.get(type(entry), 0),
+        filepath,
+        entry.meta.get("lineno", 0),
+    )
+
+
+def _write_run(path, records):
+    with open(path, "wb") as fd:
+        for record in records:
+            pickle.dump(record, fd, pickle.HIGHEST_PROTOCOL)
+
+
+def _read_run(path):
+    with open(path, "rb") as fd:
+        while True:
+            try:
+                yield pickle.load(fd)
+            except EOFError:
+                return
+
+
+class BatchImport:
+    """Extract many files into one date/account ordered stream, with bounded
+    memory.
+
+    Extracted entries are rendered to text right away and kept together with
+    their sort key. Once the buffered records exceed `max_memory` bytes they
+    are sorted and spilled to a temporary run file. `write` merge-sorts the
+    runs (at most `max_open_runs` at a time) with what is left in memory, so
+    memory use does not depend on the number of files or rows.
+    """
+
+    def __init__(
+        self,
+        importer,
+        max_memory: int = 64 * 1024 * 1024,
+        tmpdir: Optional[str] = None,
+        max_open_runs: int = 64,
+    ):
+        if max_open_runs < 2:
+            raise ValueError("max_open_runs must be at least 2")
+
+        self.importer = importer
+        self.max_memory = max_memory
+        self.max_open_runs = max_open_runs
+
+        self._tmpdir = tempfile.mkdtemp(prefix="beancount-ing-", dir=tmpdir)
+        self._buffer = []
+        self._buffered = 0
+        self._runs = []
+        self._run_count = 0
+
+    @property
+    def runs(self) -> int:
+        """Number of runs currently spilled to disk."""
+        return len(self._runs)
+
+    def add(self, filepath: str):
+        """Extract `filepath` into the batch."""
+        for entry in self.importer.iter_extract(filepath):
+            text = format_entry(entry)
+
+            self._buffer.append((_sort_key(entry, filepath), text))
+            self._buffered += len(text) + _RECORD_OVERHEAD
+
+            if self._buffered >= self.max_memory:
+                self._spill()
+
+    def add_all(self, filepaths: Iterable[str]):
+        for filepath in filepaths:
+            self.add(filepath)
+
+    def _new_run_path(self):
+        self._run_count += 1
+
+        return os.path.join(self._tmpdir, f"run-{self._run_count}")
+
+    def _spill(self):
+        if not self._buffer:
+            return
+
+        self._buffer.sort()
+
+        path = self._new_run_path()
+        _write_run(path, self._buffer)
+        self._runs.append(path)
+
+        self._buffer = []
+        self._buffered = 0
+
+    def _merge_runs(self):
+        # reduce the number of runs until all of them can be opened at once
+        while len(self._runs) > self.max_open_runs:
+            runs = []
+
+            for start in range(0, len(self._runs), self.max_open_runs):
+                group = self._runs[start : start + self.max_open_runs]
+                path = self._new_run_path()
+
+                _write_run(path, heapq.merge(*map(_read_run, group)))
+                runs.append(path)
+
+                for run in group:
+                    os.remove(run)
+
+            self._runs = runs
+
+    def iter_sorted(self):
+        """Yield the rendered entries of the whole batch in sort order."""
+        self._buffer.sort()
+
+        if len(self._runs) + 1 > self.max_open_runs:
+            self._spill()
+
+        self._merge_runs()
+
+        for _, text in heapq.merge(*map(_read_run, self._runs), self._buffer):
+            yield text
+
+    def write(self, output):
+        """Write the batch to `output`, one entry per paragraph."""
+        chunk = [HEADER + "\n"]
+
+        for text in self.iter_sorted():
+            chunk.append(text + "\n")
+
+            if len(chunk) >= 1024:
+                output.write("".join(chunk))
+                chunk.clear()
+
+        output.write("".join(chunk))
+
+    def close(self):
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+        self._buffer = []
+        self._runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
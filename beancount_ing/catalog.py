@@ -0,0 +1,405 @@
+import os
+import sqlite3
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from beancount.core.number import Decimal
+from beangulp import utils
+
+from .parsing import (
+    InvalidFormatError,
+    format_iban,
+    is_column_header,
+    open_export,
+    parse_cents_de_bytes,
+    read_account_info,
+    remap_field_names,
+    split_quoted_row,
+    split_record,
+)
+
+
+# bump whenever the layout of the catalog database changes, older catalogs
+# are rebuilt from scratch
+CATALOG_VERSION = 1
+
+# the header of an export is expected within that many lines
+_MAX_HEADER_LINES = 32
+
+# header metadata of an ING export, `date_from` and `date_to` are the
+# (inclusive) Zeitraum, `first_saldo` and `last_saldo` the Saldo of the first
+# and last row in file order
+export_info = namedtuple('export_info', [
+    'path',
+    'iban',
+    'user',
+    'date_from',
+    'date_to',
+    'sorting',
+    'rows',
+    'first_saldo',
+    'last_saldo',
+])
+
+# days of an account that no export covers
+coverage_gap = namedtuple('coverage_gap', [
+    'date_from',
+    'date_to',
+])
+
+# two exports of an account covering the same days
+export_overlap = namedtuple('export_overlap', [
+    'first',
+    'second',
+    'date_from',
+    'date_to',
+])
+
+# the exports known for an account
+account_summary = namedtuple('account_summary', [
+    'iban',
+    'user',
+    'files',
+    'date_from',
+    'date_to',
+])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exports (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    iban TEXT,
+    user TEXT,
+    date_from TEXT,
+    date_to TEXT,
+    sorting TEXT,
+    rows INTEGER,
+    first_saldo TEXT,
+    last_saldo TEXT
+);
+CREATE INDEX IF NOT EXISTS exports_by_account
+    ON exports (iban, date_from, date_to);
+"""
+
+
+def _parse_date(value: str) -> Optional[date]:
+    try:
+        return datetime.strptime(value.strip(), "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+def read_export_info(filepath: str, encoding: str = "ISO-8859-1"):
+    """Read the header metadata of an ING export in a single pass.
+
+    Unlike `ECImporter.identify`, this does not depend on the IBAN or user of
+    an importer. Returns an `export_info`, or None if `filepath` is not an ING
+    export.
+    """
+    with open_export(filepath, encoding, "catalog") as reader:
+        if reader is None:
+            return None
+
+        try:
+            meta = read_account_info(reader.read_line)
+        except InvalidFormatError:
+            return None
+
+        for _ in range(_MAX_HEADER_LINES):
+            line = reader.read_line()
+
+            if is_column_header(line):
+                break
+
+            if line.startswith("Sortierung;"):
+                meta["Sortierung"] = split_quoted_row(line)[1:]
+        else:
+            return None
+
+        columns = remap_field_names(split_quoted_row(line))
+
+        if "Saldo" not in columns:
+            return None
+
+        i_saldo = columns.index("Saldo")
+        rows = 0
+        first = last = None
+
+        for _, raw in reader.records():
+            if not raw:
+                continue
+
+            rows += 1
+            last = raw
+
+            if first is None:
+                first = raw
+
+    def _saldo(raw):
+        if raw is None:
+            return None
+
+        value = split_record(raw, encoding)[i_saldo]
+
+        return str(Decimal(parse_cents_de_bytes(value)).scaleb(-2))
+
+    def _value(key):
+        values = meta.get(key)
+
+        return values[0].strip() if values else None
+
+    date_from = date_to = None
+    splits = (_value("Zeitraum") or "").split(" - ")
+
+    if len(splits) == 2:
+        date_from, date_to = map(_parse_date, splits)
+
+    return export_info(
+        filepath,
+        format_iban(_value("IBAN")) if _value("IBAN") else None,
+        _value("Kunde"),
+        date_from,
+        date_to,
+        _value("Sortierung"),
+        rows,
+        _saldo(first),
+        _saldo(last),
+    )
+
+
+class Catalog:
+    """SQLite index of the header metadata of ING exports.
+
+    `scan` reads the header (and counts the rows) of every file once and
+    only looks at it again when its mtime or size changes. Coverage, gap and
+    overlap queries per account (IBAN) are then answered from the index
+    without touching the exports.
+    """
+
+    def __init__(self, path: str, encoding: str = "ISO-8859-1"):
+        self.path = path
+        self.encoding = encoding
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.connection = sqlite3.connect(path)
+
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+
+        if version != CATALOG_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS exports")
+            self.connection.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+
+        self.connection.executescript(_SCHEMA)
+
+    def scan(self, paths: Iterable[str]) -> int:
+        """Index all files in `paths` (files or directories).
+
+        Files that did not change since the last scan are skipped and files
+        that disappeared from the scanned directories are dropped from the
+        catalog. Returns the number of files (re)indexed.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        known = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in self.connection.execute(
+                "SELECT path, mtime_ns, size FROM exports"
+            )
+        }
+        seen = set()
+        updated = 0
+
+        with self.connection:
+            for filepath in utils.walk(paths):
+                stat = os.stat(filepath)
+                seen.add(filepath)
+
+                if known.get(filepath) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+
+                try:
+                    info = read_export_info(filepath, self.encoding)
+                except (OSError, ValueError, IndexError, InvalidFormatError):
+                    info = None
+
+                if info is None:
+                    # remembered as well, so that it is not read again
+                    info = export_info(filepath, *[None] * 8)
+
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO exports VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        filepath,
+                        stat.st_mtime_ns,
+                        stat.st_size,
+                        info.iban,
+                        info.user,
+                        info.date_from and info.date_from.isoformat(),
+                        info.date_to and info.date_to.isoformat(),
+                        info.sorting,
+                        info.rows,
+                        info.first_saldo,
+                        info.last_saldo,
+                    ),
+                )
+                updated += 1
+
+            roots = tuple(os.path.join(path, "") for path in paths)
+            removed = [
+                (path,)
+                for path in known
+                if path not in seen and (path in paths or path.startswith(roots))
+            ]
+
+            self.connection.executemany("DELETE FROM exports WHERE path = ?", removed)
+
+        return updated
+
+    def _rows_to_info(self, rows):
+        return [
+            export_info(
+                path,
+                iban,
+                user,
+                date.fromisoformat(date_from),
+                date.fromisoformat(date_to),
+                sorting,
+                count,
+                first_saldo and Decimal(first_saldo),
+                last_saldo and Decimal(last_saldo),
+            )
+            for (
+                path,
+                iban,
+                user,
+                date_from,
+                date_to,
+                sorting,
+                count,
+                first_saldo,
+                last_saldo,
+            ) in rows
+        ]
+
+    def accounts(self):
+        """Return an `account_summary` for every IBAN in the catalog."""
+        rows = self.connection.execute(
+            "SELECT iban, MAX(user), COUNT(*), MIN(date_from), MAX(date_to) "
+            "FROM exports WHERE iban IS NOT NULL GROUP BY iban ORDER BY iban"
+        )
+
+        return [
+            account_summary(
+                iban,
+                user,
+                files,
+                date_from and date.fromisoformat(date_from),
+                date_to and date.fromisoformat(date_to),
+            )
+            for iban, user, files, date_from, date_to in rows
+        ]
+
+    def exports(
+        self,
+        iban: str,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+    ):
+        """Return the exports of `iban` whose Zeitraum overlaps the given
+        (inclusive) range, ordered by Zeitraum."""
+        rows = self.connection.execute(
+            "SELECT path, iban, user, date_from, date_to, sorting, rows, "
+            "first_saldo, last_saldo FROM exports "
+            "WHERE iban = ? AND date_from IS NOT NULL AND date_to IS NOT NULL "
+            "AND date_to >= ? AND date_from <= ? "
+            "ORDER BY date_from, date_to, path",
+            (
+                format_iban(iban),
+                (date_from or date.min).isoformat(),
+                (date_to or date.max).isoformat(),
+            ),
+        )
+
+        return self._rows_to_info(rows)
+
+    def gaps(
+        self,
+        iban: str,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+    ):
+        """Return the `coverage_gap` of `iban` within the given range.
+
+        The range defaults to the first and last day covered by any export,
+        so without bounds only the holes between exports are reported.
+        """
+        exports = self.exports(iban, date_from, date_to)
+
+        if not exports:
+            if date_from and date_to:
+                return [coverage_gap(date_from, date_to)]
+
+            return []
+
+        date_from = date_from or exports[0].date_from
+        date_to = date_to or max(export.date_to for export in exports)
+
+        gaps = []
+        covered = date_from - timedelta(days=1)
+
+        for export in exports:
+            if export.date_from > covered + timedelta(days=1):
+                gaps.append(
+                    coverage_gap(
+                        covered + timedelta(days=1),
+                        export.date_from - timedelta(days=1),
+                    )
+                )
+
+            covered = max(covered, export.date_to)
+
+        if covered < date_to:
+            gaps.append(coverage_gap(covered + timedelta(days=1), date_to))
+
+        return gaps
+
+    def overlaps(
+        self,
+        iban: str,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+    ):
+        """Return every pair of exports of `iban` whose Zeitraum overlaps, as
+        `export_overlap` with the days both of them cover."""
+        overlaps = []
+        active = []
+
+        for export in self.exports(iban, date_from, date_to):
+            active = [other for other in active if other.date_to >= export.date_from]
+
+            for other in active:
+                overlaps.append(
+                    export_overlap(
+                        other.path,
+                        export.path,
+                        export.date_from,
+                        min(other.date_to, export.date_to),
+                    )
+                )
+
+            active.append(export)
+
+        return overlaps
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
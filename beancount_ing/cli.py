@@ -1,9 +1,21 @@
+import json
 import sys
 import tomllib
+import warnings
 from pathlib import Path
 
-from beangulp.testing import main as bg_main
+import click
+from beangulp import exceptions, utils
+from beangulp.testing import wrap
 from beancount_ing import ECImporter
+from beancount_ing.batch import BatchImport
+from beancount_ing.catalog import Catalog
+from beancount_ing.daemon import Daemon, query
+from beancount_ing.export import EXPORT_FORMATS
+from beancount_ing.journal import JournalIndex
+from beancount_ing.parsing import InvalidFormatError
+from beancount_ing.rules import default_cache_dir, load_import_rules
+from beancount_ing.writer import ExtractedWriter
 
 
 def ec():
@@ -13,14 +25,598 @@ def ec():
     account_name = config["account_name"]
     user = config["user"]
     file_encoding = config.get("file_encoding", "ISO-8859-1")
+    parser = config.get("parser", "csv")
+
+    # rules are validated (and checked against regex_check_budget) while
+    # loading, the importer only has to compile them
+    import_rules = load_import_rules(
+        config, base_dir=Path("."), cache_dir=_rules_cache_dir(config)
+    )
 
     importer = ECImporter(
         iban,
         account_name,
         user,
         file_encoding=file_encoding,
+        import_rules=import_rules,
+        parser=parser,
+        regex_backend=config.get("regex_backend", "re"),
+        regex_timeout=config.get("regex_timeout"),
+    )
+    _main(
+        importer,
+        daemon,
+        rule_stats,
+        check_saldo,
+        validate,
+        batch,
+        insert,
+        export,
+        catalog,
+    )
+
+
+def _rules_cache_dir(config):
+    if not config.get("rules_cache", True):
+        return None
+
+    if "rules_cache_dir" in config:
+        return Path(config["rules_cache_dir"])
+
+    return default_cache_dir()
+
+
+def _main(importer, *commands):
+    # same as beangulp.testing.main, with our own subcommands added
+    if not sys.warnoptions:
+        warnings.simplefilter("default")
+
+    cli = wrap(importer)
+    cli.add_command(_with_stream_option(cli.commands["extract"]))
+
+    for command in commands:
+        cli.add_command(command)
+
+    cli()
+
+
+def _with_stream_option(extract):
+    """Return a copy of beangulp's extract command with a --stream option."""
+    callback = extract.callback
+
+    @click.pass_obj
+    def _extract(ctx, stream, src, output, existing, reverse, failfast, quiet):
+        if not stream:
+            return callback(
+                src=src,
+                output=output,
+                existing=existing,
+                reverse=reverse,
+                failfast=failfast,
+                quiet=quiet,
+            )
+
+        if existing or reverse:
+            raise click.UsageError(
+                "--stream supports neither --existing nor --reverse."
+            )
+
+        importer = ctx.importers[0]
+        log = utils.logger(-quiet, err=True)
+        errors = exceptions.ExceptionsTrap(log)
+
+        with ExtractedWriter(output) as writer:
+            for filename in utils.walk(src):
+                log(f"* {filename}", nl=False)
+
+                with errors:
+                    if not importer.identify(filename):
+                        log("")
+                        continue
+
+                    log(" ...", nl=False)
+                    writer.write_section(filename, importer.iter_extract(filename))
+                    log(" OK", fg="green")
+
+                if failfast and errors:
+                    break
+
+        if errors:
+            sys.exit(1)
+
+    return click.Command(
+        extract.name,
+        params=[
+            click.Option(
+                ["--stream"],
+                is_flag=True,
+                help="Write entries while extracting, in file order and without "
+                "sorting or de-duplication.",
+            ),
+            *extract.params,
+        ],
+        callback=_extract,
+        help=extract.help,
+    )
+
+
+@click.group("daemon")
+def daemon():
+    """Watch a download directory and extract new exports as they arrive."""
+
+
+@daemon.command("run")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False),
+    help="Journal the extracted entries are appended to (without de-duplication).",
+)
+@click.option(
+    "--output-dir",
+    "-d",
+    type=click.Path(exists=True, file_okay=False),
+    help="Directory receiving one .beancount file per extracted export.",
+)
+@click.option(
+    "--interval",
+    "-i",
+    type=float,
+    default=2.0,
+    show_default=True,
+    help="Seconds between directory scans.",
+)
+@click.option("--socket", "socket_path", help="Path of the control socket.")
+@click.option(
+    "--process-existing",
+    is_flag=True,
+    help="Also extract files already present when the daemon starts.",
+)
+@click.option(
+    "--insert",
+    is_flag=True,
+    help="Insert entries into the --output journal by date instead of appending.",
+)
+@click.pass_obj
+def _daemon_run(
+    ctx, directory, output, output_dir, interval, socket_path, process_existing, insert
+):
+    """Watch DIRECTORY and extract every new file identified by the importer."""
+    if (output is None) == (output_dir is None):
+        raise click.UsageError(
+            "Exactly one of --output and --output-dir is required."
+        )
+
+    if insert and output is None:
+        raise click.UsageError("--insert requires --output.")
+
+    watcher = Daemon(
+        ctx.importers[0],
+        directory,
+        output=output,
+        output_dir=output_dir,
+        interval=interval,
+        socket_path=socket_path,
+        process_existing=process_existing,
+        insert=insert,
     )
-    bg_main(importer)
+
+    try:
+        watcher.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+@daemon.command("status")
+@click.option(
+    "--socket", "socket_path", required=True, help="Path of the control socket."
+)
+def _daemon_status(socket_path):
+    """Print status and throughput metrics of a running daemon."""
+    click.echo(json.dumps(query(socket_path, "status"), indent=2))
+
+
+@daemon.command("stop")
+@click.option(
+    "--socket", "socket_path", required=True, help="Path of the control socket."
+)
+def _daemon_stop(socket_path):
+    """Ask a running daemon to stop."""
+    click.echo(json.dumps(query(socket_path, "stop")))
+
+
+@click.command("rule-stats")
+@click.argument("documents", nargs=-1, type=click.Path(exists=True))
+@click.option(
+    "--top",
+    "-n",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Number of most expensive patterns to list.",
+)
+@click.pass_obj
+def rule_stats(ctx, documents, top):
+    """Report unused and expensive import rules.
+
+    Extract all DOCUMENTS (files or directories) identified by the importer
+    and list the import rules that never matched, followed by the patterns
+    that took the most time.
+    """
+    importer = ctx.importers[0]
+    importer.collect_rule_stats = True
+    importer.reset_rule_stats()
+
+    count = 0
+
+    for document in utils.walk(documents):
+        if importer.identify(document):
+            importer.extract(document)
+            count += 1
+
+    stats = importer.rule_stats()
+
+    click.echo(f"{count} file(s), {len(importer.import_rules)} rule(s)")
+
+    matches = {}
+
+    for stat in stats:
+        matches[stat.rule_index] = matches.get(stat.rule_index, 0) + stat.matches
+
+    dead = [
+        index for index in range(len(importer.import_rules)) if not matches.get(index)
+    ]
+
+    click.echo(f"\nRules that never matched ({len(dead)}):")
+
+    for index in dead:
+        patterns = [
+            f"{stat.kind}={stat.pattern!r}"
+            for stat in stats
+            if stat.rule_index == index
+        ]
+        click.echo(f"  #{index}: {', '.join(patterns)}")
+
+    click.echo(f"\nMost expensive patterns (top {top}):")
+
+    for stat in sorted(stats, key=lambda stat: stat.seconds, reverse=True)[:top]:
+        click.echo(
+            f"  #{stat.rule_index} {stat.kind}={stat.pattern!r}: "
+            f"{stat.seconds * 1000:.2f}ms, "
+            f"{stat.evaluations} evaluations, {stat.matches} matches"
+        )
+
+
+@click.command("check-saldo")
+@click.argument("documents", nargs=-1, type=click.Path(exists=True))
+@click.pass_obj
+def check_saldo(ctx, documents):
+    """Verify the Saldo chain of exports.
+
+    For every file in DOCUMENTS (files or directories) identified by the
+    importer, check that each row's Saldo equals the previous Saldo plus the
+    row's amount, and print the lines where the chain breaks.
+    """
+    importer = ctx.importers[0]
+    failures = 0
+
+    for document in utils.walk(documents):
+        if not importer.identify(document):
+            continue
+
+        try:
+            breaks = importer.check_saldo_chain(document)
+        except ValueError as exc:
+            click.echo(f"{document}: {exc}", err=True)
+            failures += 1
+            continue
+        except InvalidFormatError as exc:
+            click.echo(str(exc) or f"{document}: invalid format", err=True)
+            failures += 1
+            continue
+
+        for saldo_break in breaks:
+            click.echo(
+                f"{document}:{saldo_break.lineno}: Saldo {saldo_break.actual}, "
+                f"expected {saldo_break.expected}"
+            )
+
+        failures += bool(breaks)
+
+    if failures:
+        sys.exit(1)
+
+
+@click.command("validate")
+@click.argument("documents", nargs=-1, type=click.Path(exists=True))
+@click.option(
+    "--all",
+    "-a",
+    "all_files",
+    is_flag=True,
+    help="Also validate files the importer does not identify.",
+)
+@click.option(
+    "--max-errors",
+    type=int,
+    default=20,
+    show_default=True,
+    help="Maximum number of errors reported per file.",
+)
+@click.pass_obj
+def validate(ctx, documents, all_files, max_errors):
+    """Check exports for structural errors without extracting them.
+
+    Validate the header, account information, column layout and field
+    syntax of every file in DOCUMENTS (files or directories) identified by
+    the importer, or of all files with --all, and print every error found.
+    """
+    importer = ctx.importers[0]
+    files = invalid = 0
+
+    for document in utils.walk(documents):
+        if not all_files and not importer.identify(document):
+            continue
+
+        files += 1
+        errors = importer.validate(document, max_errors=max_errors)
+
+        for error in errors:
+            click.echo(f"{document}:{error.lineno}: {error.message}")
+
+        invalid += bool(errors)
+
+    click.echo(f"{files} file(s), {invalid} invalid", err=True)
+
+    if invalid:
+        sys.exit(1)
+
+
+def _parse_size(value: str) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    value = value.strip().upper().rstrip("B")
+
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+
+    return int(value)
+
+
+@click.command("batch")
+@click.argument("src", nargs=-1, type=click.Path(exists=True))
+@click.option("--output", "-o", type=click.File("w"), default="-", help="Output file.")
+@click.option(
+    "--max-memory",
+    "-m",
+    default="64M",
+    show_default=True,
+    help="Memory ceiling for buffered entries (e.g. 512K, 64M, 1G).",
+)
+@click.option(
+    "--tmpdir",
+    type=click.Path(exists=True, file_okay=False),
+    help="Directory for the temporary runs.",
+)
+@click.option("--quiet", "-q", count=True, help="Suppress all output.")
+@click.pass_obj
+def batch(ctx, src, output, max_memory, tmpdir, quiet):
+    """Extract a whole archive with bounded memory.
+
+    Extract all files in SRC (files or directories) identified by the
+    importer and write their entries as a single stream ordered by date and
+    account. Once the buffered entries exceed --max-memory they are spilled
+    to temporary files, which are merge-sorted into the output.
+    """
+    try:
+        max_memory = _parse_size(max_memory)
+    except ValueError:
+        raise click.BadParameter(
+            f"invalid size {max_memory!r}", param_hint="--max-memory"
+        )
+
+    importer = ctx.importers[0]
+    log = utils.logger(-quiet, err=True)
+
+    with BatchImport(importer, max_memory=max_memory, tmpdir=tmpdir) as batch_import:
+        for filename in utils.walk(src):
+            log(f"* {filename}", nl=False)
+
+            if not importer.identify(filename):
+                log("")
+                continue
+
+            batch_import.add(filename)
+            log(" OK", fg="green")
+
+        batch_import.write(output)
+
+
+@click.command("insert")
+@click.argument("src", nargs=-1, type=click.Path(exists=True))
+@click.option(
+    "--journal",
+    "-j",
+    type=click.Path(dir_okay=False),
+    required=True,
+    help="Date-sorted journal the entries are inserted into.",
+)
+@click.option("--index", "index_path", help="Index file, <journal>.idx by default.")
+@click.option("--quiet", "-q", count=True, help="Suppress all output.")
+@click.pass_obj
+def insert(ctx, src, journal, index_path, quiet):
+    """Insert extracted entries into a journal, keeping it sorted by date.
+
+    Extract all files in SRC (files or directories) identified by the
+    importer and insert the entries in front of the first entry with a later
+    date. A sidecar index of the journal's dates and byte offsets is kept up
+    to date, so only the part of the journal after the earliest new entry is
+    rewritten. Entries are not de-duplicated.
+    """
+    importer = ctx.importers[0]
+    log = utils.logger(-quiet, err=True)
+    entries = []
+
+    for filename in utils.walk(src):
+        if importer.identify(filename):
+            log(f"* {filename}")
+            entries.extend(importer.extract(filename))
+
+    written = JournalIndex(journal, index_path).insert(entries)
+    log(f"{len(entries)} entries inserted, {written} bytes written", fg="green")
+
+
+@click.command("export")
+@click.argument("src", nargs=-1, type=click.Path(exists=True))
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False),
+    required=True,
+    help="Columnar file to write (.parquet, .arrow or .npz).",
+)
+@click.option(
+    "--format",
+    "-f",
+    "format",
+    type=click.Choice(EXPORT_FORMATS),
+    help="Output format, guessed from the --output suffix by default.",
+)
+@click.option("--quiet", "-q", count=True, help="Suppress all output.")
+@click.pass_obj
+def export(ctx, src, output, format, quiet):
+    """Export parsed rows to Parquet, Arrow or NumPy.
+
+    Parse all files in SRC (files or directories) identified by the importer
+    and write one row per transaction, with the index of the matching import
+    rule, to a columnar file for analysis with pandas, polars or DuckDB.
+    """
+    importer = ctx.importers[0]
+    log = utils.logger(-quiet, err=True)
+    filenames = []
+
+    for filename in utils.walk(src):
+        if importer.identify(filename):
+            log(f"* {filename}")
+            filenames.append(filename)
+
+    path = importer.export(filenames, output, format=format)
+    log(f"{path} OK", fg="green")
+
+
+def _catalog_options(function):
+    function = click.option(
+        "--db",
+        type=click.Path(dir_okay=False),
+        help="Catalog database [default: <cache dir>/catalog.sqlite3].",
+    )(function)
+
+    return click.pass_obj(function)
+
+
+def _open_catalog(ctx, db):
+    importer = ctx.importers[0]
+
+    return Catalog(
+        db or str(default_cache_dir() / "catalog.sqlite3"),
+        encoding=importer.file_encoding,
+    )
+
+
+def _account_options(function):
+    function = click.option(
+        "--iban", help="Account to query, the importer's IBAN by default."
+    )(function)
+    function = click.option(
+        "--from", "date_from", type=click.DateTime(["%Y-%m-%d"]), help="First day."
+    )(function)
+    function = click.option(
+        "--to", "date_to", type=click.DateTime(["%Y-%m-%d"]), help="Last day."
+    )(function)
+
+    return _catalog_options(function)
+
+
+def _account_query(ctx, iban, date_from, date_to):
+    return (
+        iban or ctx.importers[0].iban,
+        date_from and date_from.date(),
+        date_to and date_to.date(),
+    )
+
+
+@click.group("catalog")
+def catalog():
+    """Index ING exports and query their coverage per account."""
+
+
+@catalog.command("scan")
+@click.argument("src", nargs=-1, type=click.Path(exists=True))
+@_catalog_options
+def _catalog_scan(ctx, src, db):
+    """Add the exports in SRC (files or directories) to the catalog.
+
+    Only files that are new or changed since the last scan are read.
+    """
+    with _open_catalog(ctx, db) as export_catalog:
+        updated = export_catalog.scan(src)
+
+    click.echo(f"{updated} file(s) indexed")
+
+
+@catalog.command("accounts")
+@_catalog_options
+def _catalog_accounts(ctx, db):
+    """List the accounts in the catalog."""
+    with _open_catalog(ctx, db) as export_catalog:
+        for account in export_catalog.accounts():
+            click.echo(
+                f"{account.iban} {account.user}: {account.files} file(s), "
+                f"{account.date_from} - {account.date_to}"
+            )
+
+
+@catalog.command("coverage")
+@_account_options
+def _catalog_coverage(ctx, db, iban, date_from, date_to):
+    """List the exports covering an account."""
+    with _open_catalog(ctx, db) as export_catalog:
+        for export_ in export_catalog.exports(
+            *_account_query(ctx, iban, date_from, date_to)
+        ):
+            click.echo(
+                f"{export_.date_from} - {export_.date_to} {export_.path} "
+                f"({export_.rows} rows, Saldo {export_.first_saldo} - "
+                f"{export_.last_saldo})"
+            )
+
+
+@catalog.command("gaps")
+@_account_options
+def _catalog_gaps(ctx, db, iban, date_from, date_to):
+    """List the days of an account no export covers."""
+    with _open_catalog(ctx, db) as export_catalog:
+        gaps = export_catalog.gaps(*_account_query(ctx, iban, date_from, date_to))
+
+    for gap in gaps:
+        click.echo(f"{gap.date_from} - {gap.date_to}")
+
+    if gaps:
+        sys.exit(1)
+
+
+@catalog.command("overlaps")
+@_account_options
+def _catalog_overlaps(ctx, db, iban, date_from, date_to):
+    """List exports of an account covering the same days."""
+    with _open_catalog(ctx, db) as export_catalog:
+        for overlap in export_catalog.overlaps(
+            *_account_query(ctx, iban, date_from, date_to)
+        ):
+            click.echo(
+                f"{overlap.date_from} - {overlap.date_to} "
+                f"{overlap.first} {overlap.second}"
+            )
 
 
 def _extract_config(section: str):
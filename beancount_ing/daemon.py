@@ -0,0 +1,305 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from beangulp import extract
+
+from .journal import JournalIndex
+from .writer import ExtractedWriter
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # pragma: no cover - optional dependency
+    INotify = None
+
+
+log = logging.getLogger()
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as fd:
+        fd.seek(-1, os.SEEK_END)
+
+        return fd.read(1) == b"\n"
+
+
+class Daemon:
+    """Watch a download directory and extract new ING exports as they land.
+
+    The importer is kept warm between files, so interpreter startup, imports
+    and rule compilation are only paid once. New files are picked up by
+    polling the directory (or through inotify, when `inotify_simple` is
+    installed) and the extracted entries are either appended to a journal
+    (`output`) or written next to each other into a directory (`output_dir`).
+    With `insert`, entries are inserted into the (date-sorted) `output`
+    journal by date instead of being appended, see `JournalIndex`.
+
+    Entries are not checked against the journal: a file extracted twice
+    (or overlapping exports) ends up twice in `output`.
+    """
+
+    def __init__(
+        self,
+        importer,
+        directory: str,
+        output: Optional[str] = None,
+        output_dir: Optional[str] = None,
+        interval: float = 2.0,
+        socket_path: Optional[str] = None,
+        process_existing: bool = False,
+        insert: bool = False,
+    ):
+        if (output is None) == (output_dir is None):
+            raise ValueError("Exactly one of output and output_dir is required")
+
+        if insert and output is None:
+            raise ValueError("insert requires output")
+
+        self.importer = importer
+        self.directory = directory
+        self.output = output
+        self.output_dir = output_dir
+        self.interval = interval
+        self.socket_path = socket_path
+        self.journal_index = JournalIndex(output) if insert else None
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server = None
+
+        # path -> (mtime_ns, size) of files that have been handled already
+        self._done: Dict[str, Tuple[int, int]] = {}
+        # path -> (mtime_ns, size) as observed by the previous scan
+        self._pending: Dict[str, Tuple[int, int]] = {}
+
+        self._started_at = time.time()
+        self._metrics = {
+            "files_seen": 0,
+            "files_identified": 0,
+            "files_extracted": 0,
+            "files_failed": 0,
+            "entries_extracted": 0,
+            "bytes_extracted": 0,
+            "extract_seconds": 0.0,
+            "last_file": None,
+            "last_error": None,
+        }
+
+        if not process_existing:
+            self._done.update(self._signatures())
+
+    def _signatures(self) -> Dict[str, Tuple[int, int]]:
+        signatures = {}
+
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if not dir_entry.is_file() or dir_entry.name.startswith("."):
+                    continue
+
+                stat = dir_entry.stat()
+                signatures[dir_entry.path] = (stat.st_mtime_ns, stat.st_size)
+
+        return signatures
+
+    def scan(self, ready: Tuple[str, ...] = ()) -> List[str]:
+        """Return the files that are new (or changed) and ready to be processed.
+
+        Files that are still being written are skipped: a file is only ready
+        once its size and mtime did not change between two scans, or when it
+        is listed in `ready` (e.g. because inotify reported it as closed).
+        """
+        signatures = self._signatures()
+        pending = {}
+        files = []
+
+        for path, signature in sorted(signatures.items()):
+            if self._done.get(path) == signature:
+                continue
+
+            if path in ready or self._pending.get(path) == signature:
+                files.append(path)
+            else:
+                pending[path] = signature
+
+        self._pending = pending
+
+        return files
+
+    def process(self, filepath: str):
+        """Identify and extract a single file, writing out its entries.
+
+        A file is only marked as done once it was written out (or not
+        identified); files that failed are retried on the next scans.
+        """
+        stat = os.stat(filepath)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            self._metrics["files_seen"] += 1
+            self._metrics["last_file"] = filepath
+
+        try:
+            if not self.importer.identify(filepath):
+                self._done[filepath] = signature
+                return
+
+            with self._lock:
+                self._metrics["files_identified"] += 1
+
+            start = time.perf_counter()
+            entries = extract.extract_from_file(self.importer, filepath, [])
+            elapsed = time.perf_counter() - start
+
+            self._write(filepath, entries)
+        except Exception as exc:
+            log.exception(f"Failed to process {filepath}")
+
+            with self._lock:
+                self._metrics["files_failed"] += 1
+                self._metrics["last_error"] = f"{filepath}: {exc!r}"
+
+            return
+
+        self._done[filepath] = signature
+
+        with self._lock:
+            self._metrics["files_extracted"] += 1
+            self._metrics["entries_extracted"] += len(entries)
+            self._metrics["bytes_extracted"] += stat.st_size
+            self._metrics["extract_seconds"] += elapsed
+
+    def _write(self, filepath: str, entries):
+        if self.journal_index is not None:
+            self.journal_index.insert(entries)
+        elif self.output is not None:
+            # the header is only written to a new (or empty) journal
+            with open(self.output, "a") as fd:
+                header = fd.tell() == 0
+
+                if not header and not _ends_with_newline(self.output):
+                    fd.write("\n")
+
+                with ExtractedWriter(fd, header=header) as writer:
+                    writer.write_section(filepath, entries)
+        else:
+            name = os.path.basename(filepath) + ".beancount"
+
+            with open(os.path.join(self.output_dir, name), "w") as fd:
+                with ExtractedWriter(fd) as writer:
+                    writer.write_section(filepath, entries)
+
+    def run_once(self, ready: Tuple[str, ...] = ()) -> int:
+        files = self.scan(ready)
+
+        for filepath in files:
+            self.process(filepath)
+
+        return len(files)
+
+    def status(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+
+        seconds = metrics["extract_seconds"]
+        metrics.update(
+            {
+                "directory": self.directory,
+                "uptime_seconds": time.time() - self._started_at,
+                "watching": "inotify" if INotify is not None else "polling",
+                "entries_per_second": (
+                    metrics["entries_extracted"] / seconds if seconds else 0.0
+                ),
+                "bytes_per_second": (
+                    metrics["bytes_extracted"] / seconds if seconds else 0.0
+                ),
+            }
+        )
+
+        return metrics
+
+    def stop(self):
+        self._stop.set()
+
+    def serve_forever(self):
+        """Watch the directory until `stop` is called (or a `stop` command is
+        received on the control socket)."""
+        if self.socket_path:
+            self._start_control_server()
+
+        inotify = None
+
+        if INotify is not None:
+            inotify = INotify()
+            inotify.add_watch(
+                self.directory, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO
+            )
+
+        try:
+            while not self._stop.is_set():
+                ready = ()
+
+                if inotify is not None:
+                    events = inotify.read(timeout=int(self.interval * 1000))
+                    ready = tuple(
+                        os.path.join(self.directory, event.name) for event in events
+                    )
+                else:
+                    self._stop.wait(self.interval)
+
+                self.run_once(ready)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+            self._stop_control_server()
+
+    def _start_control_server(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                command = self.rfile.readline().decode().strip() or "status"
+
+                if command == "status":
+                    reply = daemon.status()
+                elif command == "stop":
+                    daemon.stop()
+                    reply = {"stopping": True}
+                else:
+                    reply = {"error": f"unknown command {command!r}"}
+
+                self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self._server.daemon_threads = True
+
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def _stop_control_server(self):
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def query(socket_path: str, command: str = "status") -> dict:
+    """Send `command` to a running daemon's control socket and return the reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(command.encode() + b"\n")
+
+        with sock.makefile("rb") as fd:
+            return json.loads(fd.readline())
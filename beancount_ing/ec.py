@@ -1,6 +1,10 @@
+import asyncio
+import contextlib
+import copy
 import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from itertools import count
 import re
 import warnings
 from collections import namedtuple
@@ -12,10 +16,27 @@ from beancount.core import data, flags
 from beancount.core.number import Decimal
 from beangulp.importer import Importer
 
+from .parsing import (
+    FIRST_HEADER,
+    META_KEYS,
+    SECOND_HEADER,
+    InvalidFormatError,
+    format_iban,
+    is_ascii_compatible,
+    is_column_header,
+    open_export,
+    parse_cents_de_bytes,
+    parse_date_de_bytes,
+    parse_number_de_bytes,
+    read_account_info,
+    remap_field_names,
+    split_quoted_row,
+    split_record,
+)
+from .rules import REGEX_BACKENDS, compile_import_rules, import_rule  # NOQA
 
-BANKS = ("ING", "ING-DiBa")
 
-META_KEYS = ("IBAN", "Kontoname", "Bank", "Kunde", "Zeitraum", "Saldo")
+BANKS = ("ING", "ING-DiBa")
 
 PRE_HEADER = (
     "In der CSV-Datei finden Sie alle bereits gebuchten Umsätze. "
@@ -23,15 +44,140 @@ PRE_HEADER = (
     "Ihrem Internetbanking angezeigt werden."
 )
 
+# "csv" tokenizes the data section with the csv module, "mmap" memory-maps the
+# file and splits records at the byte level
+PARSERS = ("csv", "mmap")
+
 log = logging.getLogger()
 #log.setLevel(logging.INFO)
 
-class InvalidFormatError(Exception):
-    pass
 
+# progress of a running extract, passed to the `progress` callback
+extract_progress = namedtuple('extract_progress', [
+    'rows',
+    'bytes',
+    'elapsed',
+])
+
+
+class ExtractCancelled(Exception):
+    """Raised by `ECImporter.extract` when the cancellation token was set or
+    the deadline passed. `reason` is either "cancelled" or "deadline"."""
+
+    def __init__(self, reason: str, progress: extract_progress):
+        super().__init__(
+            f"extract {reason} after {progress.rows} rows "
+            f"({progress.elapsed:.2f}s)"
+        )
+        self.reason = reason
+        self.progress = progress
 
-def _format_iban(iban):
-    return re.sub(r"\s+", "", iban, flags=re.UNICODE)
+
+# a break of the Saldo chain: the row at `lineno` (1-based line of the file)
+# has a Saldo of `actual`, while the previous row in date order implies
+# `expected`
+saldo_break = namedtuple('saldo_break', [
+    'lineno',
+    'expected',
+    'actual',
+])
+
+
+# a parsed row of the data section, see `ECImporter.iter_rows`
+ing_row = namedtuple('ing_row', [
+    'filename',
+    'lineno',
+    'booking_date',
+    'value_date',
+    'payee',
+    'booking_text',
+    'purpose',
+    'amount',
+    'currency',
+    'saldo',
+    'saldo_currency',
+    'rule',
+])
+
+
+# a problem found by `ECImporter.validate` at `lineno` (1-based line of the
+# file)
+validation_error = namedtuple('validation_error', [
+    'lineno',
+    'message',
+])
+
+# columns the importer needs in the data section
+REQUIRED_COLUMNS = (
+    "Buchung",
+    "Auftraggeber/Empfänger",
+    "Buchungstext",
+    "Verwendungszweck",
+    "Saldo",
+    "Währung_1",
+    "Betrag",
+    "Währung_2",
+)
+
+# syntax of the data section fields, by kind (see `_field_kind`)
+_FIELD_PATTERNS = {
+    "date": rb"(\d{2}\.\d{2}\.\d{4})",
+    "amount": rb"-?(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d{1,2})?",
+    "currency": rb"[A-Z]{3}",
+    None: rb'[^;"]*',
+}
+
+_FIELD_DESCRIPTIONS = {
+    "date": "a date (DD.MM.YYYY)",
+    "amount": "an amount (e.g. -1.234,56)",
+    "currency": "a currency code",
+}
+
+
+def _match_rule_index(rules, payee, narration):
+    # index of the rule _get_fixed_entry would apply
+    for index, rule in enumerate(rules):
+        if payee and any(pattern.search(payee) for pattern in rule.payee_regexs):
+            return index
+        if narration and any(
+            pattern.search(narration) for pattern in rule.description_regexs
+        ):
+            return index
+
+    return None
+
+
+class _ExtractMonitor:
+    """Progress reporting and cancellation checks, done every `interval`
+    rows of the data section."""
+
+    def __init__(self, progress, cancel, deadline, interval):
+        self.progress = progress
+        self.cancel = cancel
+        self.deadline = deadline
+        self.interval = interval
+        self.start = time.monotonic()
+
+    def check(self, rows, consumed):
+        now = time.monotonic()
+        state = extract_progress(rows, consumed, now - self.start)
+
+        if self.progress is not None:
+            self.progress(state)
+
+        if self.cancel is not None and self.cancel.is_set():
+            raise ExtractCancelled("cancelled", state)
+
+        if self.deadline is not None and now >= self.deadline:
+            raise ExtractCancelled("deadline", state)
+
+        return self.interval
+
+    def finish(self, rows, consumed):
+        if self.progress is not None:
+            self.progress(
+                extract_progress(rows, consumed, time.monotonic() - self.start)
+            )
 
 
 def _format_number_de(value: str) -> Decimal:
@@ -40,10 +186,48 @@ def _format_number_de(value: str) -> Decimal:
 
     return Decimal(value.replace(thousands_sep, "").replace(decimal_sep, "."))
 
-import_rule = namedtuple('import_rule',[
-    'replacements',
-    'payee_regexs',
-    'description_regexs',
+
+def _field_kind(name):
+    if name in ("Buchung", "Valuta"):
+        return "date"
+    if name in ("Betrag", "Saldo"):
+        return "amount"
+    if name.startswith("Währung"):
+        return "currency"
+    return None
+
+
+def _field_error(name, value: bytes):
+    # message describing why `value` is not valid for column `name`, or None
+    kind = _field_kind(name)
+
+    if kind is None:
+        return None
+
+    if re.fullmatch(_FIELD_PATTERNS[kind], value):
+        if kind != "date":
+            return None
+
+        try:
+            parse_date_de_bytes(value)
+            return None
+        except ValueError:
+            pass
+
+    value = value.decode("ascii", "replace")
+
+    return f"{name}: expected {_FIELD_DESCRIPTIONS[kind]}, got {value!r}"
+
+
+# statistics of a single pattern of an import rule, `kind` is either "payee"
+# or "description"
+rule_stat = namedtuple('rule_stat', [
+    'rule_index',
+    'kind',
+    'pattern',
+    'evaluations',
+    'matches',
+    'seconds',
 ])
 
 class ECImporter(Importer):
@@ -53,70 +237,82 @@ class ECImporter(Importer):
         account_name: str,
         user: str,
         file_encoding: Optional[str] = "ISO-8859-1",
-        import_rules=[]
+        import_rules=[],
+        parser: str = "csv",
+        regex_backend: str = "re",
+        regex_timeout: Optional[float] = None,
+        regex_check_budget: Optional[float] = None,
+        collect_rule_stats: bool = False,
     ):
-        self.iban = _format_iban(iban)
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser {parser!r}, expected one of {PARSERS}")
+
+        if regex_backend not in REGEX_BACKENDS:
+            raise ValueError(
+                f"Unknown regex backend {regex_backend!r}, "
+                f"expected one of {REGEX_BACKENDS}"
+            )
+
+        if parser == "mmap" and not is_ascii_compatible(file_encoding):
+            raise ValueError(
+                f"The mmap parser requires an ASCII compatible encoding, "
+                f"got {file_encoding!r}"
+            )
+
+        self.iban = format_iban(iban)
         self.account_name = account_name
         self.user = user
         self.file_encoding = file_encoding
+        self.parser = parser
+        self.regex_backend = regex_backend
+        self.regex_timeout = regex_timeout
+        self.regex_check_budget = regex_check_budget
 
         self._date_from = None
         self._date_to = None
         self._line_index = -1
         self.import_rules = import_rules
+        self._compiled_import_rules = None
+        self._compiled_import_rules_source = None
+        # (rule index, kind, pattern) -> [evaluations, matches, seconds]
+        self._rule_stats = {} if collect_rule_stats else None
+        # compile (and check) eagerly, so that invalid and pathological
+        # patterns are reported when the importer is created
+        self._get_compiled_import_rules()
         log.debug(f"Loaded importer with the folloging rules: {self.import_rules}")
 
     def account(self, filepath: str) -> data.Account:
         return self.account_name
 
     def _is_valid_first_header(self, line):
-        return line.startswith("Umsatzanzeige;Datei erstellt am")
+        return line.startswith(FIRST_HEADER)
 
     def _is_valid_second_header(self, line):
-        return line == ";Letztes Update: aktuell"
+        return line == SECOND_HEADER
 
     def identify(self, filepath: str):
         with open(filepath, encoding=self.file_encoding) as fd:
-
-            def _read_line():
-                return fd.readline().strip()
-
-            # Header - first line
-            line = _read_line()
-
-            if not self._is_valid_first_header(line):
+            try:
+                meta = read_account_info(lambda: fd.readline().strip())
+            except InvalidFormatError:
                 return False
 
-            # Header - second line (optional)
-            line = _read_line()
+        return self._is_own_account(meta)
 
-            if line:
-                if not self._is_valid_second_header(line):
-                    return False
-                # Empty line
-                line = _read_line()
+    def _is_own_account(self, meta):
+        # whether the account information read by `read_account_info` matches
+        # the IBAN, bank and user of this importer
+        for key, values in meta.items():
+            value = values[0] if values else ""
 
-            if line:
+            if key == "IBAN" and format_iban(value) != self.iban:
                 return False
 
-            # Meta
-            lines = [_read_line() for _ in range(len(META_KEYS))]
-
-            reader = csv.reader(
-                lines, delimiter=";", quoting=csv.QUOTE_MINIMAL, quotechar='"'
-            )
-
-            for line in reader:
-                key, value, *_ = line
-
-                if key == "IBAN" and _format_iban(value) != self.iban:
-                    return False
-
-                if key == "Bank" and value not in BANKS:
-                    return False
+            if key == "Bank" and value not in BANKS:
+                return False
 
-                if key == "Kunde" and value != self.user:
-                    return False
+            if key == "Kunde" and value != self.user:
+                return False
 
         return True
 
@@ -140,6 +336,9 @@ class ECImporter(Importer):
         return entry
 
     def _get_fixed_entry(self, entry, rules):
+        if self._rule_stats is not None:
+            return self._get_fixed_entry_with_stats(entry, rules)
+
         log.debug("Matching rules for entry " + str(entry))
         for rule in rules:
             # match payee
@@ -162,25 +361,118 @@ class ECImporter(Importer):
                     log.debug("no match")
         return entry
 
-    def _compile_import_rules(self, rules):
-        comp_import_rules = []
-        for rule in rules:
-            if len(rule) != 3:
-                raise(ValueError(f"Invalid rule configuration: {rule}"))
-            compiled_rule = import_rule(
-                (rule[0]),
-                tuple((re.compile(r, re.IGNORECASE) for r in rule[1])),
-                tuple((re.compile(r, re.IGNORECASE) for r in rule[2])),
-            )
-            comp_import_rules.append(compiled_rule)
-        return comp_import_rules
+    def _get_fixed_entry_with_stats(self, entry, rules):
+        # same as _get_fixed_entry, but counting evaluations, matches and the
+        # time spent in each pattern
+        stats = self._rule_stats
+        clock = time.perf_counter
 
-    def extract(self, filepath: str, existing_entries: Optional[data.Entries] = None):
-        entries = []
-        self._line_index = 0
+        for index, rule in enumerate(rules):
+            for kind, patterns, string in (
+                ("payee", rule.payee_regexs, entry.payee),
+                ("description", rule.description_regexs, entry.narration),
+            ):
+                if not string:
+                    continue
+
+                for pattern in patterns:
+                    key = (index, kind, pattern.pattern)
+                    counters = stats.get(key)
+
+                    if counters is None:
+                        counters = stats[key] = [0, 0, 0.0]
+
+                    start = clock()
+                    match = pattern.search(string)
+                    counters[2] += clock() - start
+                    counters[0] += 1
+
+                    if match:
+                        counters[1] += 1
+                        return self._fix_entry(entry, rule[0])
+
+        return entry
+
+    def rule_stats(self):
+        """Return a `rule_stat` for every pattern of every import rule.
+
+        Counters are only collected if the importer was created with
+        ``collect_rule_stats=True`` and accumulate over all `extract` calls
+        until `reset_rule_stats` is called.
+        """
+        if self._rule_stats is None:
+            raise ValueError("Rule statistics are disabled (collect_rule_stats)")
+
+        stats = []
+
+        for index, rule in enumerate(self._get_compiled_import_rules()):
+            for kind, patterns in (
+                ("payee", rule.payee_regexs),
+                ("description", rule.description_regexs),
+            ):
+                for pattern in patterns:
+                    evaluations, matches, seconds = self._rule_stats.get(
+                        (index, kind, pattern.pattern), (0, 0, 0.0)
+                    )
+                    stats.append(
+                        rule_stat(
+                            index, kind, pattern.pattern, evaluations, matches, seconds
+                        )
+                    )
+
+        return stats
+
+    def _merge_rule_stats(self, stats):
+        # add the counters of a copy's `_rule_stats` to ours
+        for key, (evaluations, matches, seconds) in stats.items():
+            counters = self._rule_stats.setdefault(key, [0, 0, 0.0])
+            counters[0] += evaluations
+            counters[1] += matches
+            counters[2] += seconds
+
+    def reset_rule_stats(self):
+        if self._rule_stats is not None:
+            self._rule_stats.clear()
+
+    @property
+    def collect_rule_stats(self) -> bool:
+        return self._rule_stats is not None
+
+    @collect_rule_stats.setter
+    def collect_rule_stats(self, value: bool):
+        if not value:
+            self._rule_stats = None
+        elif self._rule_stats is None:
+            self._rule_stats = {}
+
+    def _compile_import_rules(self, rules):
+        return compile_import_rules(
+            rules,
+            backend=self.regex_backend,
+            timeout=self.regex_timeout,
+            check_budget=self.regex_check_budget,
+        )
+
+    def _get_compiled_import_rules(self):
+        # pre-compile import rules for performance, once per importer (as long
+        # as `import_rules` is not replaced)
+        if self._compiled_import_rules_source is not self.import_rules:
+            self._compiled_import_rules = self._compile_import_rules(self.import_rules)
+            self._compiled_import_rules_source = self.import_rules
+            self.reset_rule_stats()
+
+        return self._compiled_import_rules
+
+    def _read_header(self, filepath: str, read_line):
+        """Consume everything up to (and including) the empty line in front of
+        the CSV data section.
+
+        Returns a ``(ascending_by_date, descending_by_date)`` tuple describing
+        the declared sorting of the data section.
+        """
 
         def _read_line():
-            line = fd.readline().strip()
+            line = read_line()
             self._line_index += 1
 
             return line
@@ -191,200 +483,805 @@ class ECImporter(Importer):
             if line:
                 raise InvalidFormatError()
 
-        # pre-compile import rules for performance
-        compiled_import_rules = self._compile_import_rules(self.import_rules)
+        meta = read_account_info(_read_line)
+        # the lines of the account information are counted twice, which the
+        # line numbers in the metadata of extracted entries rely on
+        self._line_index += len(META_KEYS)
 
-        with open(filepath, encoding=self.file_encoding) as fd:
-            # Header - first line
-            line = _read_line()
+        if not self._is_own_account(meta):
+            raise InvalidFormatError()
+
+        # "Saldo" is not a useful balance, because it is valid on the date of
+        # generating the CSV (see first header line) and not on the closing
+        # date of the transactions (see metadata field "Zeitraum")
+        if "Zeitraum" in meta:
+            splits = meta["Zeitraum"][0].strip().split(" - ")
 
-            if not self._is_valid_first_header(line):
+            if len(splits) != 2:
                 raise InvalidFormatError()
 
-            # Header - second line (optional)
+            self._date_from = datetime.strptime(splits[0], "%d.%m.%Y").date()
+            self._date_to = datetime.strptime(splits[1], "%d.%m.%Y").date()
+
+        # Empty line
+        _read_empty_line()
+
+        # Pre-header line (or optional sorting line)
+        line = _read_line()
+
+        descending_by_date = ascending_by_date = None
+
+        if line.startswith("Sortierung"):
+            if re.match(".*Datum absteigend", line):
+                descending_by_date = True
+            elif re.match(".*Datum aufsteigend", line):
+                ascending_by_date = True
+            else:
+                warnings.warn(
+                    f"{filepath}:{self._line_index}: "
+                    "balance assertions can only be generated "
+                    "if transactions are sorted by date"
+                )
+            _read_empty_line()
+
             line = _read_line()
 
-            if line:
-                if not self._is_valid_second_header(line):
-                    raise InvalidFormatError()
+        if line != PRE_HEADER:
+            raise InvalidFormatError()
 
-                # Empty line
-                _read_empty_line()
+        # Empty line
+        _read_empty_line()
 
-            # Meta
-            lines = [_read_line() for _ in range(len(META_KEYS))]
+        return ascending_by_date, descending_by_date
 
-            reader = csv.reader(
-                lines, delimiter=";", quoting=csv.QUOTE_MINIMAL, quotechar='"'
-            )
+    @contextlib.contextmanager
+    def _data_records(self, filepath: str, purpose: str):
+        """Memory-map `filepath`, parse its header and provide the data section.
 
-            for line in reader:
-                key, *values = line
-                self._line_index += 1
+        Yields ``(ascending_by_date, descending_by_date, columns, reader)``
+        where `columns` maps field names to indices and `reader` is the
+        `ExportReader` positioned at the first row.
+        """
+        with open_export(filepath, self.file_encoding, purpose) as reader:
+            if reader is None:
+                raise InvalidFormatError()
 
-                if key == "IBAN":
-                    if _format_iban(values[0]) != self.iban:
-                        raise InvalidFormatError()
-                elif key == "Bank":
-                    if values[0] not in BANKS:
-                        raise InvalidFormatError()
-                elif key == "Kunde":
-                    if values[0] != self.user:
-                        raise InvalidFormatError()
-                elif key == "Zeitraum":
-                    splits = values[0].strip().split(" - ")
-
-                    if len(splits) != 2:
-                        raise InvalidFormatError()
-
-                    self._date_from = datetime.strptime(splits[0], "%d.%m.%Y").date()
-                    self._date_to = datetime.strptime(splits[1], "%d.%m.%Y").date()
-                elif key == "Saldo":
-                    # actually this is not a useful balance, because it is
-                    # valid on the date of generating the CSV (see first header
-                    # line) and not on the closing date of the transactions
-                    # (see metadata field 'Zeitraum')
-                    pass
-
-            # Empty line
-            _read_empty_line()
+            self._line_index = 0
+            ascending, descending = self._read_header(filepath, reader.read_line)
 
-            # Pre-header line (or optional sorting line)
-            line = _read_line()
+            columns = {
+                name: index
+                for index, name in enumerate(
+                    remap_field_names(split_quoted_row(reader.read_line()))
+                )
+            }
+
+            yield ascending, descending, columns, reader
+
+    def check_saldo_chain(self, filepath: str):
+        """Verify that ``previous Saldo + Betrag == Saldo`` holds for every row.
+
+        The rows are walked once, in the order declared by the ``Sortierung``
+        line, using exact integer arithmetic on cents and constant memory.
+        Returns the list of `saldo_break` found (empty if the chain is
+        intact). After a break the chain continues from the actual Saldo, so
+        a single missing or duplicated row is reported once. Rows with a
+        Saldo currency different from the amount currency restart the chain.
+
+        Raises `ValueError` if the file does not declare a sorting by date
+        and `InvalidFormatError` (naming the file and line) for a row whose
+        Saldo or Betrag cannot be parsed.
+        """
+        breaks = []
+
+        with self._data_records(filepath, "Saldo check") as (
+            ascending,
+            descending,
+            columns,
+            reader,
+        ):
+            if not ascending and not descending:
+                raise ValueError(
+                    f"{filepath}: the Saldo chain can only be checked "
+                    "if transactions are sorted by date"
+                )
 
-            descending_by_date = ascending_by_date = None
+            try:
+                i_saldo = columns["Saldo"]
+                i_amount = columns["Betrag"]
+                i_saldo_currency = columns["Währung_1"]
+                i_currency = columns["Währung_2"]
+            except KeyError:
+                raise InvalidFormatError()
 
-            if line.startswith("Sortierung"):
-                if re.match(".*Datum absteigend", line):
-                    descending_by_date = True
-                elif re.match(".*Datum aufsteigend", line):
-                    ascending_by_date = True
-                else:
+            previous = None
+
+            for lineno, fields in reader.rows():
+                try:
+                    saldo = parse_cents_de_bytes(fields[i_saldo])
+                    amount = parse_cents_de_bytes(fields[i_amount])
+                    same_currency = fields[i_saldo_currency] == fields[i_currency]
+                except (IndexError, ValueError, InvalidFormatError):
+                    if len(fields) != len(columns):
+                        message = f"expected {len(columns)} fields, got {len(fields)}"
+                    else:
+                        message = _field_error(
+                            "Saldo", fields[i_saldo]
+                        ) or _field_error("Betrag", fields[i_amount])
+
+                    raise InvalidFormatError(f"{filepath}:{lineno}: {message}")
+
+                if not same_currency:
+                    previous = None
+                    continue
+
+                if previous is not None:
+                    if ascending:
+                        # previous (older) Saldo + this amount
+                        expected = previous[0] + amount
+                    else:
+                        # previous (newer) Saldo - previous amount
+                        expected = previous[0] - previous[1]
+
+                    if expected != saldo:
+                        breaks.append(
+                            saldo_break(
+                                lineno,
+                                Decimal(expected).scaleb(-2),
+                                Decimal(saldo).scaleb(-2),
+                            )
+                        )
+
+                previous = (saldo, amount)
+
+        return breaks
+
+    def validate(self, filepath: str, max_errors: Optional[int] = None):
+        """Check the structure of an export without extracting it.
+
+        Verifies the header lines, the `META_KEYS` block (including the IBAN,
+        Bank and Kunde expected by this importer), `PRE_HEADER`, the column
+        layout and the syntax of the dates, amounts and currencies of every
+        row. No Transactions are built and no import rules are run.
+
+        Returns all `validation_error` found (empty for a valid file), at
+        most `max_errors` if given.
+        """
+        encoding = self.file_encoding
+        errors = []
+
+        def _error(at, message):
+            errors.append(validation_error(at, message))
+
+        with open_export(filepath, encoding, "validation") as reader:
+            if reader is None:
+                return [validation_error(1, "empty file")]
+
+            try:
+                columns = self._validate_header(reader, _error)
+            except UnicodeDecodeError as exc:
+                _error(reader.lineno, f"cannot decode line as {encoding}: {exc}")
+                columns = None
+
+            if columns is None:
+                return errors
+
+            row_match = re.compile(
+                b";".join(_FIELD_PATTERNS[_field_kind(name)] for name in columns)
+            ).fullmatch
+            valid_dates = set()
+
+            for lineno, raw in reader.records():
+                if max_errors is not None and len(errors) >= max_errors:
+                    break
+
+                if not raw:
+                    _error(lineno, "empty line in the data section")
+                    continue
+
+                # fast path: the row is well-formed, only the calendar dates
+                # are left to check
+                match = row_match(raw)
+
+                if match is not None:
+                    for value in match.groups():
+                        if value in valid_dates:
+                            continue
+
+                        try:
+                            parse_date_de_bytes(value)
+                            valid_dates.add(value)
+                        except ValueError:
+                            _error(lineno, f"invalid date {value.decode('ascii')!r}")
+
+                    continue
+
+                fields = split_record(raw, encoding)
+
+                if len(fields) != len(columns):
+                    _error(lineno, f"expected {len(columns)} fields, got {len(fields)}")
+                    continue
+
+                for name, value in zip(columns, fields):
+                    message = _field_error(name, value)
+
+                    if message is not None:
+                        _error(lineno, message)
+
+        if max_errors is not None:
+            del errors[max_errors:]
+
+        return errors
+
+    def _validate_header(self, reader, error):
+        """Error-collecting counterpart of `_read_header`, used by `validate`.
+
+        Reads the header lines from the `ExportReader` `reader`. Instead of
+        stopping at the first problem, missing empty lines are reported and
+        skipped. Returns the (remapped) column names of the data section, or
+        None if the data section cannot be located.
+        """
+
+        def read_line():
+            line = reader.read_line()
+            return reader.lineno, line
+
+        lineno, line = read_line()
+
+        if not self._is_valid_first_header(line):
+            error(lineno, "not an ING export: invalid first header line")
+            return None
+
+        # Header - second line (optional)
+        lineno, line = read_line()
+
+        if self._is_valid_second_header(line):
+            lineno, line = read_line()
+
+        if line and not line.startswith(tuple(key + ";" for key in META_KEYS)):
+            error(lineno, f"unexpected line {line!r}")
+            lineno, line = read_line()
+
+        if line:
+            error(lineno, "expected an empty line in front of the account information")
+        else:
+            lineno, line = read_line()
+
+        # Meta
+        seen = set()
+
+        while (
+            line
+            and not line.startswith("Sortierung")
+            and line != PRE_HEADER
+            and not is_column_header(line)
+        ):
+            key, *values = split_quoted_row(line)
+
+            if key not in META_KEYS:
+                error(lineno, f"unknown account information {key!r}")
+            elif key in seen:
+                error(lineno, f"duplicate account information {key!r}")
+            else:
+                seen.add(key)
+                message = self._meta_error(key, values)
+
+                if message is not None:
+                    error(lineno, message)
+
+            lineno, line = read_line()
+
+        missing = [key for key in META_KEYS if key not in seen]
+
+        if missing:
+            error(lineno, f"missing account information: {', '.join(missing)}")
+
+        if not line:
+            lineno, line = read_line()
+        elif not is_column_header(line):
+            error(lineno, "expected an empty line after the account information")
+            lineno, line = read_line()
+
+        # Sorting line (optional)
+        if line.startswith("Sortierung"):
+            lineno, line = read_line()
+
+            if line:
+                error(lineno, "expected an empty line after the sorting line")
+            else:
+                lineno, line = read_line()
+
+        # Pre-header line
+        if line == PRE_HEADER:
+            lineno, line = read_line()
+
+            if line:
+                error(lineno, "expected an empty line after the pre-header line")
+            else:
+                lineno, line = read_line()
+        elif is_column_header(line):
+            error(lineno, "missing pre-header line")
+        else:
+            error(lineno, f"expected the pre-header line, got {line!r}")
+            lineno, line = read_line()
+
+            if not line:
+                lineno, line = read_line()
+
+        # Column header
+        if not line:
+            error(lineno, "missing column header")
+            return None
+
+        columns = remap_field_names(split_quoted_row(line))
+        missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+
+        if missing:
+            error(lineno, f"missing columns: {', '.join(missing)}")
+
+        return columns
+
+    def _meta_error(self, key, values):
+        # message describing why the account information is invalid, or None
+        if not values or not values[0].strip():
+            return f"missing value for {key}"
+
+        value = values[0].strip()
+
+        if key == "IBAN" and format_iban(value) != self.iban:
+            return f"IBAN {value} does not match {self.iban}"
+
+        if key == "Bank" and value not in BANKS:
+            return f"unknown bank {value!r}"
+
+        if key == "Kunde" and value != self.user:
+            return f"Kunde {value!r} does not match {self.user!r}"
+
+        if key == "Zeitraum":
+            splits = value.split(" - ")
+
+            try:
+                if len(splits) != 2:
+                    raise ValueError()
+
+                for split in splits:
+                    datetime.strptime(split, "%d.%m.%Y")
+            except ValueError:
+                return f"Zeitraum: expected DD.MM.YYYY - DD.MM.YYYY, got {value!r}"
+
+        if key == "Saldo":
+            amount = value.encode(self.file_encoding)
+            currency = values[1].encode(self.file_encoding) if len(values) > 1 else b""
+
+            if _field_error("Saldo", amount) or _field_error("Währung", currency):
+                return f"Saldo: expected an amount and a currency, got {values!r}"
+
+        return None
+
+    def iter_rows(self, filepath: str):
+        """Yield every row of the data section as an `ing_row`, without
+        building Transactions.
+
+        Dates are `datetime.date`, amounts and Saldo exact Decimals and
+        `rule` is the index of the first import rule matching the row (the
+        one `extract` would apply), or None.
+        """
+        encoding = self.file_encoding
+        rules = self._get_compiled_import_rules()
+
+        with self._data_records(filepath, "row export") as (_, _, columns, reader):
+            try:
+                i_date = columns["Buchung"]
+                i_value_date = columns["Valuta"]
+                i_payee = columns["Auftraggeber/Empfänger"]
+                i_booking_text = columns["Buchungstext"]
+                i_purpose = columns["Verwendungszweck"]
+                i_amount = columns["Betrag"]
+                i_currency = columns["Währung_2"]
+                i_saldo = columns["Saldo"]
+                i_saldo_currency = columns["Währung_1"]
+            except KeyError:
+                raise InvalidFormatError()
+
+            for lineno, fields in reader.rows():
+                payee = fields[i_payee].decode(encoding)
+                booking_text = fields[i_booking_text].decode(encoding)
+                purpose = fields[i_purpose].decode(encoding)
+
+                yield ing_row(
+                    filepath,
+                    lineno,
+                    parse_date_de_bytes(fields[i_date]),
+                    parse_date_de_bytes(fields[i_value_date]),
+                    payee,
+                    booking_text,
+                    purpose,
+                    Decimal(parse_cents_de_bytes(fields[i_amount])).scaleb(-2),
+                    fields[i_currency].decode(encoding),
+                    Decimal(parse_cents_de_bytes(fields[i_saldo])).scaleb(-2),
+                    fields[i_saldo_currency].decode(encoding),
+                    _match_rule_index(
+                        rules,
+                        payee,
+                        "{} {}".format(booking_text, purpose).strip(),
+                    ),
+                )
+
+    def export(self, filepaths, path: str, format: Optional[str] = None, **kwargs):
+        """Export the rows of `filepaths` to Parquet, Arrow or NumPy .npz.
+
+        See `beancount_ing.export.export_rows`.
+        """
+        # imported here, so that pyarrow / numpy are only loaded when needed
+        from .export import export_rows
+
+        return export_rows(self, filepaths, path, format=format, **kwargs)
+
+    def _make_transaction(
+        self, filepath, lineno, date, payee, booking_text, description, amount, rules
+    ):
+        meta = data.new_metadata(filepath, lineno)
+
+        description = "{} {}".format(booking_text, description).strip()
+
+        postings = [
+            data.Posting(self.account(filepath), amount, None, None, None, None)
+        ]
+        entry = data.Transaction(
+            meta,
+            date,
+            flags.FLAG_OKAY,
+            payee,
+            description,
+            data.EMPTY_SET,
+            data.EMPTY_SET,
+            postings,
+        )
+
+        return self._get_fixed_entry(entry, rules)
+
+    def _balance_assertions(
+        self, filepath, first_transaction, last_transaction, ascending, descending
+    ):
+        def balance_assertion(transaction, opening=False, closing=False):
+            lineno = transaction[0]
+            line = transaction[1]
+            balance = _format_number_de(line["Saldo"])
+
+            if opening:
+                # calculate balance before the first transaction
+                # Currencies must match for subtraction
+                if line["Währung_1"] != line["Währung_2"]:
                     warnings.warn(
-                        f"{filepath}:{self._line_index}: "
-                        "balance assertions can only be generated "
-                        "if transactions are sorted by date"
+                        f"{filepath}:{lineno} "
+                        "opening balance can not be generated "
+                        "due to currency mismatch: "
+                        f"{line['Währung_1']} <> {line['Währung_2']}"
                     )
-                _read_empty_line()
+                    return []
+                balance -= _format_number_de(line["Betrag"])
+                balancedate = self._date_from
+
+            if closing:
+                # balance after the last transaction:
+                # next day's opening balance
+                balancedate = self._date_to + timedelta(days=1)
+
+            return [
+                data.Balance(
+                    data.new_metadata(filepath, lineno),
+                    balancedate,
+                    self.account(filepath),
+                    Amount(balance, line["Währung_1"]),
+                    None,
+                    None,
+                )
+            ]
 
-                line = _read_line()
+        entries = []
+        opening_transaction = closing_transaction = None
 
-            if line != PRE_HEADER:
-                raise InvalidFormatError()
+        # Determine first and last (by date) transactions
 
-            # Empty line
-            _read_empty_line()
+        if ascending:
+            opening_transaction = first_transaction
+            closing_transaction = last_transaction
+
+        if descending:
+            closing_transaction = first_transaction
+            opening_transaction = last_transaction
+
+        if opening_transaction:
+            entries.extend(balance_assertion(opening_transaction, opening=True))
+
+        if closing_transaction:
+            entries.extend(balance_assertion(closing_transaction, closing=True))
+
+        return entries
+
+    def extract(
+        self,
+        filepath: str,
+        existing_entries: Optional[data.Entries] = None,
+        progress=None,
+        cancel=None,
+        deadline: Optional[float] = None,
+        progress_interval: int = 1000,
+    ):
+        """Extract the entries of `filepath`.
+
+        See `iter_extract` for the progress and cancellation arguments.
+        """
+        return list(
+            self.iter_extract(
+                filepath,
+                progress=progress,
+                cancel=cancel,
+                deadline=deadline,
+                progress_interval=progress_interval,
+            )
+        )
+
+    def iter_extract(
+        self,
+        filepath: str,
+        progress=None,
+        cancel=None,
+        deadline: Optional[float] = None,
+        progress_interval: int = 1000,
+    ):
+        """Yield the entries of `extract` one at a time, as the file is parsed.
+
+        Transactions come in file order, followed by the balance assertions.
+
+        Every `progress_interval` rows of the data section, `progress` (if
+        given) is called with an `extract_progress` holding the rows
+        processed, the bytes consumed (rounded to the read buffer with the
+        csv parser) and the elapsed seconds. At the same points parsing stops
+        with `ExtractCancelled` if `cancel` (anything with an ``is_set()``
+        method, e.g. a `threading.Event`) is set or the `deadline` (in
+        `time.monotonic` seconds) has passed.
+        """
+        if progress_interval < 1:
+            raise ValueError("progress_interval must be positive")
+
+        self._line_index = 0
+
+        compiled_import_rules = self._get_compiled_import_rules()
+
+        monitor = None
+
+        if progress is not None or cancel is not None or deadline is not None:
+            monitor = _ExtractMonitor(progress, cancel, deadline, progress_interval)
+
+        if self.parser == "mmap":
+            return self._iter_extract_mmap(filepath, compiled_import_rules, monitor)
+
+        return self._iter_extract_csv(filepath, compiled_import_rules, monitor)
+
+    async def aidentify(self, filepath: str, executor=None):
+        """`identify` run in `executor` (the loop's default executor if None)."""
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(executor, self.identify, filepath)
+
+    async def aextract(
+        self,
+        filepath: str,
+        existing_entries: Optional[data.Entries] = None,
+        executor=None,
+    ):
+        """`extract` run in `executor` (the loop's default executor if None).
+
+        Parsing state lives on the importer, so each call works on a shallow
+        copy sharing the compiled rules; concurrent calls are safe. With
+        ``collect_rule_stats=True`` every copy counts on its own and the
+        counters are added to the importer's once the call is done.
+        """
+        loop = asyncio.get_running_loop()
+
+        # compile once on the original, so that the copies share the rules;
+        # off the event loop, as the worst-case checks may take seconds
+        await loop.run_in_executor(executor, self._get_compiled_import_rules)
+
+        worker = copy.copy(self)
+
+        if self._rule_stats is not None:
+            worker._rule_stats = {}
+
+        try:
+            return await loop.run_in_executor(
+                executor, worker.extract, filepath, existing_entries
+            )
+        finally:
+            if worker._rule_stats:
+                self._merge_rule_stats(worker._rule_stats)
+
+    async def aextract_many(self, filepaths, max_concurrency: int = 4, executor=None):
+        """Extract all `filepaths`, at most `max_concurrency` at a time, and
+        yield ``(filepath, entries)`` tuples in the order they complete.
+
+        Unless an `executor` is given, a thread pool of `max_concurrency`
+        workers is used for the duration of the call. If an extract fails,
+        its exception is raised and the remaining ones are cancelled.
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be positive")
+
+        own_executor = executor is None
+
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _extract(filepath):
+            async with semaphore:
+                return filepath, await self.aextract(filepath, executor=executor)
+
+        tasks = []
+
+        try:
+            # compile before the extracts start, rather than in all at once
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, self._get_compiled_import_rules)
+
+            tasks = [asyncio.ensure_future(_extract(path)) for path in filepaths]
+
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            if own_executor:
+                executor.shutdown(wait=False)
+
+    def _iter_extract_csv(self, filepath: str, compiled_import_rules, monitor=None):
+        with open(filepath, encoding=self.file_encoding) as fd:
+            ascending_by_date, descending_by_date = self._read_header(
+                filepath, lambda: fd.readline().strip()
+            )
 
             # Data entries
             reader = csv.reader(
                 fd, delimiter=";", quoting=csv.QUOTE_MINIMAL, quotechar='"'
             )
 
-            def remap(names):
-                # https://stackoverflow.com/a/31771695
-                counter = count(1)
-
-                return [
-                    "Währung_{}".format(next(counter)) if name == "Währung" else name
-                    for name in names
-                ]
-
-            field_names = remap(next(reader))
+            field_names = remap_field_names(next(reader))
 
             # memoize first and last transactions for balance assertion
             first_transaction = last_transaction = None
 
+            rows = 0
+            next_check = monitor.interval if monitor else 0
+
             for row in reader:
+                rows += 1
+                if rows == next_check:
+                    next_check += monitor.check(rows, fd.buffer.tell())
+
                 line = dict(zip(field_names, row))
 
                 # Mark first and last transaction together with line numbers
                 last_transaction = (self._line_index, line)
                 if first_transaction is None:
                     first_transaction = last_transaction
-                date = line["Buchung"]
-                payee = line["Auftraggeber/Empfänger"]
-                booking_text = line["Buchungstext"]
-                description = line["Verwendungszweck"]
-                amount = line["Betrag"]
-                currency = line["Währung_2"]
-
-                meta = data.new_metadata(filepath, self._line_index)
-
-                amount = Amount(_format_number_de(amount), currency)
-                date = datetime.strptime(date, "%d.%m.%Y").date()
-
-                description = "{} {}".format(booking_text, description).strip()
-
-                postings = [
-                    data.Posting(self.account(filepath), amount, None, None, None, None)
-                ]
-                entry = data.Transaction(
-                        meta,
-                        date,
-                        flags.FLAG_OKAY,
-                        payee,
-                        description,
-                        data.EMPTY_SET,
-                        data.EMPTY_SET,
-                        postings,
-                )
-                fixed_entry = self._get_fixed_entry(entry, compiled_import_rules)
 
-                entries.append(fixed_entry)
+                amount = Amount(_format_number_de(line["Betrag"]), line["Währung_2"])
+                date = datetime.strptime(line["Buchung"], "%d.%m.%Y").date()
+
+                yield self._make_transaction(
+                    filepath,
+                    self._line_index,
+                    date,
+                    line["Auftraggeber/Empfänger"],
+                    line["Buchungstext"],
+                    line["Verwendungszweck"],
+                    amount,
+                    compiled_import_rules,
+                )
 
                 self._line_index += 1
 
-            def balance_assertion(transaction, opening=False, closing=False):
-                lineno = transaction[0]
-                line = transaction[1]
-                balance = _format_number_de(line["Saldo"])
-
-                if opening:
-                    # calculate balance before the first transaction
-                    # Currencies must match for subtraction
-                    if line["Währung_1"] != line["Währung_2"]:
-                        warnings.warn(
-                            f"{filepath}:{lineno} "
-                            "opening balance can not be generated "
-                            "due to currency mismatch: "
-                            f"{line['Währung_1']} <> {line['Währung_2']}"
-                        )
-                        return []
-                    balance -= _format_number_de(line["Betrag"])
-                    balancedate = self._date_from
-
-                if closing:
-                    # balance after the last transaction:
-                    # next day's opening balance
-                    balancedate = self._date_to + timedelta(days=1)
-
-                return [
-                    data.Balance(
-                        data.new_metadata(filepath, lineno),
-                        balancedate,
-                        self.account(filepath),
-                        Amount(balance, line["Währung_1"]),
-                        None,
-                        None,
-                    )
-                ]
+            if monitor:
+                monitor.finish(rows, fd.buffer.tell())
 
-            opening_transaction = closing_transaction = None
+            yield from self._balance_assertions(
+                filepath,
+                first_transaction,
+                last_transaction,
+                ascending_by_date,
+                descending_by_date,
+            )
 
-            # Determine first and last (by date) transactions
+    def _iter_extract_mmap(self, filepath: str, compiled_import_rules, monitor=None):
+        """Byte-level variant of `_iter_extract_csv`.
+
+        The file is memory-mapped and the data section is split on ``;``
+        without going through `csv.reader`; only the fields that end up in a
+        Transaction are decoded. ``Saldo`` is only looked at for the rows that
+        feed the balance assertions.
+        """
+        encoding = self.file_encoding
+
+        with self._data_records(filepath, "mmap parser") as (
+            ascending_by_date,
+            descending_by_date,
+            columns,
+            reader,
+        ):
+            try:
+                i_date = columns["Buchung"]
+                i_payee = columns["Auftraggeber/Empfänger"]
+                i_booking_text = columns["Buchungstext"]
+                i_description = columns["Verwendungszweck"]
+                i_amount = columns["Betrag"]
+                i_currency = columns["Währung_2"]
+            except KeyError:
+                raise InvalidFormatError()
 
-            if ascending_by_date:
-                opening_transaction = first_transaction
-                closing_transaction = last_transaction
+            # memoize first and last transactions for balance assertion
+            first_transaction = last_transaction = None
 
-            if descending_by_date:
-                closing_transaction = first_transaction
-                opening_transaction = last_transaction
+            rows = 0
+            next_check = monitor.interval if monitor else 0
 
-            if opening_transaction:
-                entries.extend(balance_assertion(opening_transaction, opening=True))
+            for _, raw in reader.records():
+                if not raw:
+                    self._line_index += 1
+                    continue
 
-            if closing_transaction:
-                entries.extend(balance_assertion(closing_transaction, closing=True))
+                rows += 1
+                if rows == next_check:
+                    next_check += monitor.check(rows, reader.tell())
 
-        return entries
+                fields = split_record(raw, encoding)
+
+                last_transaction = (self._line_index, fields)
+                if first_transaction is None:
+                    first_transaction = last_transaction
+
+                amount = Amount(
+                    parse_number_de_bytes(fields[i_amount]),
+                    fields[i_currency].decode(encoding),
+                )
+
+                yield self._make_transaction(
+                    filepath,
+                    self._line_index,
+                    parse_date_de_bytes(fields[i_date]),
+                    fields[i_payee].decode(encoding),
+                    fields[i_booking_text].decode(encoding),
+                    fields[i_description].decode(encoding),
+                    amount,
+                    compiled_import_rules,
+                )
+
+                self._line_index += 1
+
+            if monitor:
+                monitor.finish(rows, reader.tell())
+
+        def _decode_balance_fields(transaction):
+            if transaction is None:
+                return None
+
+            lineno, fields = transaction
+
+            return (
+                lineno,
+                {
+                    name: fields[columns[name]].decode(encoding)
+                    for name in ("Saldo", "Währung_1", "Währung_2", "Betrag")
+                },
+            )
+
+        if ascending_by_date or descending_by_date:
+            yield from self._balance_assertions(
+                filepath,
+                _decode_balance_fields(first_transaction),
+                _decode_balance_fields(last_transaction),
+                ascending_by_date,
+                descending_by_date,
+            )
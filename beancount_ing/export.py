@@ -0,0 +1,194 @@
+import os
+import warnings
+from typing import Iterable, Optional
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+
+EXPORT_FORMATS = ("parquet", "arrow", "npz")
+
+# column names, in the order of `ing_row`
+COLUMNS = (
+    "filename",
+    "lineno",
+    "booking_date",
+    "value_date",
+    "payee",
+    "booking_text",
+    "purpose",
+    "amount",
+    "currency",
+    "saldo",
+    "saldo_currency",
+    "rule",
+)
+
+_SUFFIXES = {
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".npz": "npz",
+}
+
+
+def _arrow_schema():
+    return pyarrow.schema(
+        [
+            ("filename", pyarrow.string()),
+            ("lineno", pyarrow.int64()),
+            ("booking_date", pyarrow.date32()),
+            ("value_date", pyarrow.date32()),
+            ("payee", pyarrow.string()),
+            ("booking_text", pyarrow.string()),
+            ("purpose", pyarrow.string()),
+            ("amount", pyarrow.decimal128(18, 2)),
+            ("currency", pyarrow.string()),
+            ("saldo", pyarrow.decimal128(18, 2)),
+            ("saldo_currency", pyarrow.string()),
+            ("rule", pyarrow.int32()),
+        ]
+    )
+
+
+class _ArrowSink:
+    def __init__(self, path, format):
+        self.schema = _arrow_schema()
+
+        if format == "parquet":
+            self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self._writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, columns):
+        self._writer.write_batch(
+            pyarrow.record_batch(columns, schema=self.schema)
+        )
+
+    def close(self):
+        self._writer.close()
+
+
+class _NumpySink:
+    """Converts every batch to NumPy arrays right away, the .npz file itself
+    can only be written once all batches are in.
+
+    Dates are stored as ``datetime64[D]``, amounts and Saldo as ``int64``
+    cents and missing rules as -1.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._batches = {name: [] for name in COLUMNS}
+
+    def write(self, columns):
+        for name, values in zip(COLUMNS, columns):
+            if name in ("booking_date", "value_date"):
+                array = numpy.array(values, dtype="datetime64[D]")
+            elif name in ("amount", "saldo"):
+                array = numpy.array(
+                    [int(value.scaleb(2)) for value in values], dtype=numpy.int64
+                )
+            elif name == "rule":
+                array = numpy.array(
+                    [-1 if value is None else value for value in values],
+                    dtype=numpy.int32,
+                )
+            elif name == "lineno":
+                array = numpy.array(values, dtype=numpy.int64)
+            else:
+                array = numpy.array(values, dtype=str)
+
+            self._batches[name].append(array)
+
+    def close(self):
+        arrays = {}
+
+        for name, batches in self._batches.items():
+            if batches:
+                arrays[name] = numpy.concatenate(batches)
+            else:
+                arrays[name] = numpy.array([], dtype=str)
+
+        with open(self.path, "wb") as fd:
+            numpy.savez_compressed(fd, **arrays)
+
+
+def _resolve_format(path: str, format: Optional[str]):
+    if format is None:
+        format = _SUFFIXES.get(os.path.splitext(path)[1].lower(), "parquet")
+
+    if format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format {format!r}, expected one of {EXPORT_FORMATS}"
+        )
+
+    if format != "npz" and pyarrow is None:
+        path = os.path.splitext(path)[0] + ".npz"
+        warnings.warn(f"pyarrow is not installed, exporting to {path} instead")
+        format = "npz"
+
+    if format == "npz" and numpy is None:
+        raise ImportError("Exporting requires pyarrow or numpy")
+
+    return path, format
+
+
+def export_rows(
+    importer,
+    filepaths: Iterable[str],
+    path: str,
+    format: Optional[str] = None,
+    batch_size: int = 65536,
+) -> str:
+    """Write the rows of all `filepaths` to a columnar file at `path`.
+
+    `format` is "parquet", "arrow" (Arrow IPC file) or "npz" and defaults to
+    the one matching the suffix of `path`. Without pyarrow, Parquet and
+    Arrow fall back to NumPy .npz. Rows are collected in record batches of
+    `batch_size` while the files are parsed (see `ECImporter.iter_rows`).
+
+    Returns the path actually written.
+    """
+    path, format = _resolve_format(path, format)
+
+    sink = _NumpySink(path) if format == "npz" else _ArrowSink(path, format)
+    columns = [[] for _ in COLUMNS]
+    appends = [column.append for column in columns]
+    rows = 0
+
+    try:
+        for filepath in filepaths:
+            for row in importer.iter_rows(filepath):
+                for append, value in zip(appends, row):
+                    append(value)
+
+                rows += 1
+
+                if rows == batch_size:
+                    sink.write(columns)
+
+                    for column in columns:
+                        column.clear()
+
+                    rows = 0
+
+        if rows or format == "npz":
+            sink.write(columns)
+    except BaseException:
+        sink.close()
+        os.remove(path)
+        raise
+
+    sink.close()
+
+    return path
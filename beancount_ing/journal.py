@@ -0,0 +1,344 @@
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import re
+import warnings
+from datetime import date
+from typing import Iterable, Optional
+
+from beancount.core import data
+
+from .writer import format_entry
+
+
+# bump whenever the layout of the index file changes
+INDEX_VERSION = 1
+
+# number of bytes at the end of the indexed journal used to recognize it
+# again, so that entries appended by other tools are indexed incrementally
+_CHECKSUM_SIZE = 4096
+
+# a dated directive, together with the comment lines right in front of it
+_BLOCK_RE = re.compile(rb"^(?:;[^\n]*\n)*(\d{4})-(\d{2})-(\d{2})[ \t]", re.MULTILINE)
+
+
+def _scan(buffer, base: int = 0, runs=None):
+    """Append the date runs of `buffer` (located at `base` in the journal) to
+    `runs`, a list of ``(date ordinal, offset)`` with one element for every
+    block whose date differs from the one of the block before it.
+    """
+    runs = [] if runs is None else runs
+
+    for match in _BLOCK_RE.finditer(buffer):
+        try:
+            ordinal = date(*map(int, match.groups())).toordinal()
+        except ValueError:
+            continue
+
+        if not runs or runs[-1][0] != ordinal:
+            runs.append((ordinal, base + match.start()))
+
+    return runs
+
+
+def _format_backup(offset: int, tail: bytes) -> bytes:
+    # the journal's original content from `offset` on, behind a header line
+    # allowing `_parse_backup` to tell a complete backup from a damaged one
+    checksum = hashlib.sha256(tail).hexdigest()
+
+    return f"{offset} {len(tail)} {checksum}\n".encode() + tail
+
+
+def _parse_backup(backup: bytes, journal_size: int):
+    """Return ``(offset, tail)`` of a backup written by `_format_backup`.
+
+    Raises `ValueError` if the backup is incomplete or damaged, or if its
+    offset lies beyond the end of the journal (`journal_size` bytes).
+    """
+    header, _, tail = backup.partition(b"\n")
+    offset, length, checksum = header.decode("ascii").split()
+    offset, length = int(offset), int(length)
+
+    if len(tail) != length or hashlib.sha256(tail).hexdigest() != checksum:
+        raise ValueError("incomplete backup")
+
+    if not 0 <= offset <= journal_size:
+        raise ValueError("backup does not match the journal")
+
+    return offset, tail
+
+
+def _fsync_directory(path: str):
+    # make a rename or removal of `path` durable, not supported on Windows
+    if os.name != "posix":
+        return
+
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _is_sorted(runs) -> bool:
+    return all(a[0] <= b[0] for a, b in zip(runs, runs[1:]))
+
+
+class JournalIndex:
+    """Insert entries into a date-sorted Beancount journal in place.
+
+    A small sidecar index (``<journal>.idx`` by default) maps every date of
+    the journal to the byte offset of its first entry. New entries are
+    inserted in front of the first entry with a later date (or appended, if
+    there is none), so only the part of the journal following the earliest
+    insertion point is rewritten; adding entries newer than everything in
+    the journal is a plain append.
+
+    The index is checked against the journal's size and mtime before every
+    use. If the journal only grew (e.g. because entries were appended by
+    another tool) just the new part is scanned, otherwise the journal is
+    scanned again completely.
+    """
+
+    def __init__(self, journal: str, index_path: Optional[str] = None):
+        self.journal = journal
+        self.index_path = index_path or journal + ".idx"
+
+        self._backup_path = journal + ".tail"
+        self._size = 0
+        self._mtime_ns = None
+        self._checksum = ""
+        self._runs = []
+        self._sorted = True
+
+        self._recover()
+        self._load()
+
+    @property
+    def dates(self):
+        """The distinct dates of the journal, in file order."""
+        return [date.fromordinal(ordinal) for ordinal, _ in self._runs]
+
+    def _recover(self):
+        # a previous insert was interrupted while rewriting the journal: put
+        # back the original tail
+        if not os.path.exists(self._backup_path):
+            return
+
+        with open(self._backup_path, "rb") as fd:
+            backup = fd.read()
+
+        try:
+            offset, tail = _parse_backup(backup, os.path.getsize(self.journal))
+        except (OSError, ValueError):
+            rejected_path = self._backup_path + ".rejected"
+            os.replace(self._backup_path, rejected_path)
+            _fsync_directory(self._backup_path)
+
+            warnings.warn(
+                f"{self.journal}: ignored invalid backup of an interrupted insert, "
+                f"kept as {rejected_path}"
+            )
+            return
+
+        with open(self.journal, "r+b") as fd:
+            fd.seek(offset)
+            fd.write(tail)
+            fd.truncate()
+            os.fsync(fd.fileno())
+
+        os.remove(self._backup_path)
+        _fsync_directory(self._backup_path)
+
+        warnings.warn(f"{self.journal}: restored after an interrupted insert")
+
+    def _load(self):
+        try:
+            with open(self.index_path) as fd:
+                index = json.load(fd)
+        except (OSError, ValueError):
+            return
+
+        if index.get("version") != INDEX_VERSION:
+            return
+
+        self._size = index["size"]
+        self._mtime_ns = index["mtime_ns"]
+        self._checksum = index["checksum"]
+        self._runs = [tuple(run) for run in index["runs"]]
+        self._sorted = _is_sorted(self._runs)
+
+    def _save(self):
+        index = {
+            "version": INDEX_VERSION,
+            "size": self._size,
+            "mtime_ns": self._mtime_ns,
+            "checksum": self._checksum,
+            "runs": self._runs,
+        }
+
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+
+        with open(tmp_path, "w") as fd:
+            json.dump(index, fd, separators=(",", ":"))
+
+        os.replace(tmp_path, self.index_path)
+
+    def _tail_checksum(self, fd, size: int) -> str:
+        fd.seek(max(0, size - _CHECKSUM_SIZE))
+
+        return hashlib.sha256(fd.read(size - fd.tell())).hexdigest()
+
+    def refresh(self):
+        """Bring the index up to date with the journal."""
+        try:
+            stat = os.stat(self.journal)
+        except FileNotFoundError:
+            size, mtime_ns = 0, None
+        else:
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+
+        if (size, mtime_ns) == (self._size, self._mtime_ns):
+            return
+
+        if size == 0:
+            self._size, self._mtime_ns, self._checksum = size, mtime_ns, ""
+            self._runs = []
+            self._sorted = True
+            self._save()
+            return
+
+        with open(self.journal, "rb") as fd:
+            grown = (
+                self._mtime_ns is not None
+                and size >= self._size
+                and self._tail_checksum(fd, self._size) == self._checksum
+            )
+
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if grown:
+                    _scan(mm[self._size :], self._size, self._runs)
+                else:
+                    self._runs = _scan(mm)
+
+            self._checksum = self._tail_checksum(fd, size)
+
+        self._size, self._mtime_ns = size, mtime_ns
+        self._sorted = _is_sorted(self._runs)
+        self._save()
+
+    def position(self, entry_date: date) -> int:
+        """Byte offset at which entries dated `entry_date` are inserted: in
+        front of the first entry with a later date, or the end of the journal.
+        """
+        ordinal = entry_date.toordinal()
+
+        if self._sorted:
+            index = bisect.bisect_right(self._runs, (ordinal, self._size))
+
+            return self._runs[index][1] if index < len(self._runs) else self._size
+
+        # unsorted journal: in front of the first later entry in file order
+        for run_ordinal, offset in self._runs:
+            if run_ordinal > ordinal:
+                return offset
+
+        return self._size
+
+    def insert(self, entries: Iterable[data.Directive]) -> int:
+        """Insert `entries` at their date positions.
+
+        Returns the number of bytes written, i.e. the size of the inserted
+        entries plus the part of the journal that had to be moved.
+        """
+        self.refresh()
+
+        groups = {}
+
+        for entry in sorted(entries, key=data.entry_sortkey):
+            text = format_entry(entry) + "\n"
+            groups.setdefault(self.position(entry.date), []).append(text)
+
+        if not groups:
+            return 0
+
+        start = min(groups)
+
+        with open(self.journal, "ab+") as fd:
+            # the two bytes in front of the insertion point tell whether a
+            # blank line is needed to separate the new entries
+            lead = max(0, start - 2)
+            fd.seek(lead)
+            tail = fd.read()
+            prefix, tail = tail[: start - lead], tail[start - lead :]
+
+        pieces = []
+        cursor = start
+
+        for offset in sorted(groups):
+            pieces.append(tail[cursor - start : offset - start])
+
+            if offset == self._size and self._size:
+                before = (prefix + tail)[-2:]
+
+                if not before.endswith(b"\n"):
+                    pieces.append(b"\n\n")
+                elif before != b"\n\n":
+                    pieces.append(b"\n")
+
+            pieces.append("".join(groups[offset]).encode("utf-8"))
+            cursor = offset
+
+        pieces.append(tail[cursor - start :])
+        buffer = b"".join(pieces)
+
+        self._write(start, tail, buffer)
+
+        # everything up to the insertion point is unchanged, only the
+        # rewritten part has to be scanned again
+        runs = [run for run in self._runs if run[1] < start]
+        self._runs = _scan(buffer, start, runs)
+        self._sorted = _is_sorted(self._runs)
+
+        with open(self.journal, "rb") as fd:
+            stat = os.fstat(fd.fileno())
+            self._size, self._mtime_ns = stat.st_size, stat.st_mtime_ns
+            self._checksum = self._tail_checksum(fd, self._size)
+
+        self._save()
+
+        return len(buffer)
+
+    def _write(self, start: int, tail: bytes, buffer: bytes):
+        # keep the original tail around until the rewrite is on disk, so that
+        # an interrupted insert can be undone (see `_recover`)
+        if tail:
+            tmp_path = f"{self._backup_path}.{os.getpid()}.tmp"
+
+            with open(tmp_path, "wb") as fd:
+                fd.write(_format_backup(start, tail))
+                os.fsync(fd.fileno())
+
+            os.replace(tmp_path, self._backup_path)
+            _fsync_directory(self._backup_path)
+
+        with open(self.journal, "r+b") as fd:
+            fd.seek(start)
+            fd.write(buffer)
+            fd.truncate()
+            os.fsync(fd.fileno())
+
+        if tail:
+            # a backup that survives a crash would undo this insert
+            os.remove(self._backup_path)
+            _fsync_directory(self._backup_path)
+
+
+def insert_entries(
+    journal: str, entries: Iterable[data.Directive], index_path: Optional[str] = None
+) -> int:
+    """Insert `entries` into `journal` by date, see `JournalIndex.insert`."""
+    return JournalIndex(journal, index_path).insert(entries)
@@ -0,0 +1,205 @@
+"""Low-level parsing of ING CSV exports, shared by the importer and the tools
+built on top of it (catalog, validation, columnar export)."""
+
+import contextlib
+import csv
+import mmap
+import os
+import re
+from datetime import date
+from itertools import count
+
+from beancount.core.number import Decimal
+
+
+# prefix of the first line of every export
+FIRST_HEADER = "Umsatzanzeige;Datei erstellt am"
+
+# optional second line of an export
+SECOND_HEADER = ";Letztes Update: aktuell"
+
+META_KEYS = ("IBAN", "Kontoname", "Bank", "Kunde", "Zeitraum", "Saldo")
+
+
+class InvalidFormatError(Exception):
+    pass
+
+
+def format_iban(iban: str) -> str:
+    return re.sub(r"\s+", "", iban, flags=re.UNICODE)
+
+
+def parse_number_de_bytes(value: bytes) -> Decimal:
+    return Decimal(value.replace(b".", b"").replace(b",", b".").decode("ascii"))
+
+
+def parse_cents_de_bytes(value: bytes) -> int:
+    """Parse a German formatted amount into exact cents, e.g. b"-1.234,5" ->
+    -123450. Raises `InvalidFormatError` for more than two decimals."""
+    whole, _, fraction = value.replace(b".", b"").partition(b",")
+
+    if len(fraction) > 2:
+        raise InvalidFormatError()
+
+    cents = abs(int(whole)) * 100 + int(fraction.ljust(2, b"0"))
+
+    return -cents if whole.lstrip().startswith(b"-") else cents
+
+
+def parse_date_de_bytes(value: bytes) -> date:
+    day, month, year = value.split(b".")
+
+    return date(int(year), int(month), int(day))
+
+
+def is_ascii_compatible(encoding: str) -> bool:
+    """Whether the CSV syntax characters of `encoding` are plain ASCII, so
+    that records can be split at the byte level."""
+    return ";\r\n\"".encode(encoding) == b';\r\n"'
+
+
+def is_column_header(line: str) -> bool:
+    return line.startswith(('"Buchung"', "Buchung;"))
+
+
+def remap_field_names(names):
+    """Number the two "Währung" columns (Saldo and Betrag currency) as
+    "Währung_1" and "Währung_2"."""
+    # https://stackoverflow.com/a/31771695
+    counter = count(1)
+
+    return [
+        "Währung_{}".format(next(counter)) if name == "Währung" else name
+        for name in names
+    ]
+
+
+def split_quoted_row(line: str):
+    return next(
+        csv.reader([line], delimiter=";", quoting=csv.QUOTE_MINIMAL, quotechar='"')
+    )
+
+
+def read_account_info(read_line):
+    """Consume the header lines of an export up to and including the account
+    information block (see `META_KEYS`).
+
+    `read_line` returns the next line of the file, stripped. Returns a dict
+    mapping each key of the account information to its (unstripped) values.
+    Raises `InvalidFormatError` if the lines are not the start of an ING
+    export.
+    """
+    if not read_line().startswith(FIRST_HEADER):
+        raise InvalidFormatError()
+
+    # Header - second line (optional), followed by an empty line
+    line = read_line()
+
+    if line and (line != SECOND_HEADER or read_line()):
+        raise InvalidFormatError()
+
+    meta = {}
+
+    for _ in META_KEYS:
+        line = read_line()
+
+        if not line:
+            raise InvalidFormatError()
+
+        key, *values = split_quoted_row(line)
+        meta[key] = values
+
+    return meta
+
+
+def iter_raw_rows(mm):
+    """Yield the records of the data section as raw bytes, without line endings.
+
+    A record containing an unbalanced quote continues on the next line, the
+    same way `csv.reader` treats quoted newlines.
+    """
+    for raw in iter(mm.readline, b""):
+        raw = raw.rstrip(b"\r\n")
+
+        while raw.count(b'"') % 2:
+            continuation = mm.readline()
+
+            if not continuation:
+                break
+
+            raw += b"\n" + continuation.rstrip(b"\r\n")
+
+        yield raw
+
+
+def split_record(raw: bytes, encoding: str):
+    """Split a raw record into its (undecoded) fields.
+
+    Records with quoted fields (rare in ING exports) go through the csv
+    module, everything else is split on ``;`` at the byte level.
+    """
+    if b'"' in raw:
+        return [
+            field.encode(encoding) for field in split_quoted_row(raw.decode(encoding))
+        ]
+
+    return raw.split(b";")
+
+
+class ExportReader:
+    """Reads a memory-mapped export line by line (the header) and record by
+    record (the data section), keeping track of the 1-based line number of
+    the file in `lineno`."""
+
+    def __init__(self, mm, encoding: str):
+        self.mm = mm
+        self.encoding = encoding
+        self.lineno = 0
+
+    def read_line(self) -> str:
+        self.lineno += 1
+
+        return self.mm.readline().decode(self.encoding).strip()
+
+    def records(self):
+        """Yield ``(lineno, raw)`` for the remaining records, where `lineno` is
+        the line the record starts on and `raw` the undecoded record (empty
+        for empty lines). Split records with `split_record`."""
+        for raw in iter_raw_rows(self.mm):
+            self.lineno += 1
+            lineno = self.lineno
+            self.lineno += raw.count(b"\n")
+
+            yield lineno, raw
+
+    def rows(self):
+        """Like `records`, but skips empty lines and yields the split fields
+        instead of the raw record."""
+        for lineno, raw in self.records():
+            if raw:
+                yield lineno, split_record(raw, self.encoding)
+
+    def tell(self) -> int:
+        return self.mm.tell()
+
+
+@contextlib.contextmanager
+def open_export(filepath: str, encoding: str, purpose: str = "byte-level parser"):
+    """Memory-map `filepath` and yield an `ExportReader` for it, or None if the
+    file is empty.
+
+    Raises `ValueError` if `encoding` is not ASCII compatible, naming
+    `purpose` in the message.
+    """
+    if not is_ascii_compatible(encoding):
+        raise ValueError(
+            f"The {purpose} requires an ASCII compatible encoding, got {encoding!r}"
+        )
+
+    with open(filepath, "rb") as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            yield None
+            return
+
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield ExportReader(mm, encoding)
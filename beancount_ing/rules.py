@@ -0,0 +1,406 @@
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import re
+import time
+import warnings
+from collections import namedtuple
+from pathlib import Path
+from typing import Optional
+
+
+# "re" is Python's backtracking engine, "re2" the linear-time RE2 engine
+# (google-re2), "regex" the third party regex module with match timeouts and
+# "auto" picks the first one of re2 / regex / re that is installed
+REGEX_BACKENDS = ("re", "re2", "regex", "auto")
+
+# bump whenever the layout of the cached rule sets changes
+RULE_CACHE_VERSION = 1
+
+import_rule = namedtuple('import_rule',[
+    'replacements',
+    'payee_regexs',
+    'description_regexs',
+])
+
+# subject lengths used by the worst-case check: steps of 2 up to 64, where
+# exponential patterns blow up, then steps of 32 (each at most half again as
+# long as the previous one) for polynomial ones
+PROBE_LENGTHS = tuple(range(2, 65, 2)) + tuple(range(96, 2049, 32))
+
+
+def _import_backend(backend: str):
+    if backend == "auto":
+        for candidate in ("re2", "regex"):
+            try:
+                return candidate, importlib.import_module(candidate)
+            except ImportError:
+                continue
+
+        return "re", re
+
+    if backend == "re":
+        return "re", re
+
+    if backend not in REGEX_BACKENDS:
+        raise ValueError(
+            f"Unknown regex backend {backend!r}, expected one of {REGEX_BACKENDS}"
+        )
+
+    try:
+        return backend, importlib.import_module(backend)
+    except ImportError:
+        package = "google-re2" if backend == "re2" else backend
+
+        raise ImportError(
+            f"The {backend!r} regex backend requires the {package!r} package"
+        )
+
+
+class _TimeoutPattern:
+    """Pattern of the `regex` module whose searches give up after `timeout`
+    seconds, counting as no match."""
+
+    def __init__(self, compiled, timeout: float):
+        self._compiled = compiled
+        self.pattern = compiled.pattern
+        self.timeout = timeout
+
+    def search(self, string):
+        try:
+            return self._compiled.search(string, timeout=self.timeout)
+        except TimeoutError:
+            warnings.warn(
+                f"regex {self.pattern!r} timed out after {self.timeout}s "
+                f"on {string[:40]!r}..., treating it as no match"
+            )
+            return None
+
+
+class _RE2Pattern:
+    """RE2 pattern keeping the user-supplied pattern (without the inline
+    case-insensitivity flag) in `pattern`."""
+
+    def __init__(self, compiled, pattern: str):
+        self._compiled = compiled
+        self.pattern = pattern
+
+    def search(self, string):
+        return self._compiled.search(string)
+
+
+def compile_pattern(pattern: str, backend: str = "re", timeout: Optional[float] = None):
+    """Compile a case-insensitive import rule pattern with the given backend.
+
+    Raises `ValueError` if the pattern is not valid for the backend (RE2 for
+    instance rejects backreferences and lookarounds).
+    """
+    name, module = _import_backend(backend)
+
+    try:
+        if name == "re2":
+            return _RE2Pattern(module.compile("(?i)" + pattern), pattern)
+
+        compiled = module.compile(pattern, module.IGNORECASE)
+    except module.error as exc:
+        raise ValueError(f"Invalid pattern {pattern!r} for {name}: {exc}")
+
+    if name == "regex" and timeout is not None:
+        return _TimeoutPattern(compiled, timeout)
+
+    return compiled
+
+
+def _probe_strings(pattern: str, length: int):
+    alphabet = sorted({c for c in pattern.lower() if c.isalnum()} | {"a", " "})
+
+    for char in alphabet:
+        yield char * length + "!"
+
+    yield ("".join(alphabet) * length)[:length] + "!"
+
+
+def _probe_times(search, pattern: str):
+    # time of every single probe search, in order of growing length
+    for length in PROBE_LENGTHS:
+        for string in _probe_strings(pattern, length):
+            start = time.perf_counter()
+            search(string)
+            yield time.perf_counter() - start
+
+
+def _probe_worker(pattern: str, flags: int, connection):
+    # runs in a subprocess and sends the time of every probe search
+    compiled = re.compile(pattern, flags)
+    connection.send(None)
+
+    for elapsed in _probe_times(compiled.search, pattern):
+        connection.send(elapsed)
+
+    connection.close()
+
+
+def _worst_case_search_time_subprocess(compiled, budget: float) -> float:
+    # `re` searches cannot be interrupted, so the probes run in a subprocess
+    # which is killed as soon as a single search takes longer than `budget`
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_probe_worker,
+        args=(compiled.pattern, compiled.flags, sender),
+        daemon=True,
+    )
+    process.start()
+    sender.close()
+
+    worst = 0.0
+
+    try:
+        # starting the subprocess does not count against the budget
+        receiver.recv()
+
+        while True:
+            start = time.perf_counter()
+
+            if not receiver.poll(budget):
+                return max(worst, time.perf_counter() - start)
+
+            worst = max(worst, receiver.recv())
+
+            if worst > budget:
+                return worst
+    except EOFError:
+        # all probes done
+        return worst
+    finally:
+        process.kill()
+        process.join()
+        receiver.close()
+
+
+def worst_case_search_time(compiled, budget: float) -> float:
+    """Return the slowest search time of `compiled` over a set of adversarial
+    subjects of growing length.
+
+    Probing stops as soon as a single search takes longer than `budget`
+    seconds, and no search runs much longer than that: `re` patterns are
+    probed in a subprocess that is killed at the budget and `regex` patterns
+    with a match timeout of `budget`. RE2 patterns match in linear time and
+    are probed as they are.
+    """
+    if isinstance(compiled, re.Pattern):
+        return _worst_case_search_time_subprocess(compiled, budget)
+
+    if isinstance(compiled, _RE2Pattern):
+        search = compiled.search
+    else:
+        # `regex` pattern, bounded by the budget rather than by the (possibly
+        # shorter) match timeout of a `_TimeoutPattern`
+        regex_pattern = getattr(compiled, "_compiled", compiled)
+
+        def search(string):
+            try:
+                regex_pattern.search(string, timeout=budget)
+            except TimeoutError:
+                pass
+
+    worst = 0.0
+
+    for elapsed in _probe_times(search, compiled.pattern):
+        worst = max(worst, elapsed)
+
+        if worst > budget:
+            # a timed out search took (a little more than) the budget
+            return worst
+
+    return worst
+
+
+def _compile_checked_pattern(pattern, rule, backend, timeout, check_budget):
+    try:
+        compiled = compile_pattern(pattern, backend, timeout=timeout)
+    except ValueError as exc:
+        raise ValueError(f"Invalid rule configuration: {rule}: {exc}")
+
+    if check_budget is not None:
+        elapsed = worst_case_search_time(compiled, check_budget)
+
+        if elapsed > check_budget:
+            warnings.warn(
+                f"import rule {rule}: pattern {pattern!r} is pathological, "
+                f"a single search took {elapsed:.3f}s "
+                f"(budget {check_budget}s)"
+            )
+
+    return compiled
+
+
+def compile_import_rules(
+    rules,
+    backend: str = "re",
+    timeout: Optional[float] = None,
+    check_budget: Optional[float] = None,
+):
+    """Validate and compile `rules` into a list of `import_rule`.
+
+    Raises `ValueError` for malformed rules and invalid patterns. If
+    `check_budget` is given, every pattern is probed with
+    `worst_case_search_time` and pathological ones are reported as warnings.
+    Rules that are already compiled (e.g. by `load_import_rules`) are kept
+    as they are.
+    """
+    comp_import_rules = []
+    for rule in rules:
+        if isinstance(rule, import_rule):
+            comp_import_rules.append(rule)
+            continue
+        if len(rule) != 3:
+            raise(ValueError(f"Invalid rule configuration: {rule}"))
+        compiled_rule = import_rule(
+            (rule[0]),
+            tuple(
+                _compile_checked_pattern(r, rule, backend, timeout, check_budget)
+                for r in rule[1]
+            ),
+            tuple(
+                _compile_checked_pattern(r, rule, backend, timeout, check_budget)
+                for r in rule[2]
+            ),
+        )
+        comp_import_rules.append(compiled_rule)
+    return comp_import_rules
+
+
+def parse_import_rules(tables):
+    """Convert rules as written in TOML into the tuples `ECImporter` expects.
+
+    Every table may have the keys ``payee``, ``narration``, ``account``,
+    ``payee_patterns`` and ``description_patterns``.
+    """
+    rules = []
+
+    for table in tables:
+        unknown = set(table) - {
+            "payee",
+            "narration",
+            "account",
+            "payee_patterns",
+            "description_patterns",
+        }
+
+        if unknown:
+            raise ValueError(f"Invalid rule configuration: {table}")
+
+        rules.append(
+            (
+                (table.get("payee"), table.get("narration"), table.get("account")),
+                tuple(table.get("payee_patterns", ())),
+                tuple(table.get("description_patterns", ())),
+            )
+        )
+
+    return rules
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+
+    return Path(cache_home) / "beancount-ing"
+
+
+def load_import_rules(
+    config: dict,
+    base_dir: Path = Path("."),
+    cache_dir: Optional[Path] = None,
+):
+    """Load the import rules of an importer configuration section.
+
+    Rules are read from the ``import_rules`` array of tables and from the
+    ``import_rules`` array of the TOML file referenced by ``rules_file``
+    (relative to `base_dir`). They are validated with the configured
+    ``regex_backend``, ``regex_timeout`` and ``regex_check_budget`` and
+    returned as a list of compiled `import_rule`, which `ECImporter` uses as
+    they are (they are not compiled a second time).
+
+    The validated rule set is cached in `cache_dir`, keyed by a hash of the
+    rules file contents, the inline rules and the regex settings, so that
+    parsing the rules file and the worst-case checks are skipped on repeated
+    runs. Warnings found during validation are cached and emitted again.
+    Pass ``cache_dir=None`` to disable the cache.
+    """
+    backend = config.get("regex_backend", "re")
+    timeout = config.get("regex_timeout")
+    check_budget = config.get("regex_check_budget")
+
+    rules_file = config.get("rules_file")
+    rules_file_contents = b""
+
+    if rules_file:
+        rules_file_contents = (Path(base_dir) / rules_file).read_bytes()
+
+    key = hashlib.sha256()
+    key.update(rules_file_contents)
+    key.update(
+        json.dumps(
+            [
+                RULE_CACHE_VERSION,
+                config.get("import_rules", []),
+                backend,
+                timeout,
+                check_budget,
+            ],
+            sort_keys=True,
+        ).encode()
+    )
+
+    cache_file = None
+
+    if cache_dir is not None:
+        cache_file = Path(cache_dir) / f"rules-{key.hexdigest()}.json"
+
+        try:
+            cached = json.loads(cache_file.read_text())
+        except (OSError, ValueError):
+            cached = None
+
+        if cached is not None:
+            for message in cached["warnings"]:
+                warnings.warn(message)
+
+            # already validated, compiling is all that is left
+            return compile_import_rules(
+                [
+                    (tuple(replacements), tuple(payee), tuple(description))
+                    for replacements, payee, description in cached["rules"]
+                ],
+                backend,
+                timeout,
+            )
+
+    rules = parse_import_rules(config.get("import_rules", []))
+
+    if rules_file:
+        import tomllib
+
+        rules += parse_import_rules(
+            tomllib.loads(rules_file_contents.decode()).get("import_rules", [])
+        )
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        compiled = compile_import_rules(rules, backend, timeout, check_budget)
+
+    messages = [str(warning.message) for warning in caught]
+
+    for message in messages:
+        warnings.warn(message)
+
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps({"rules": rules, "warnings": messages}))
+        os.replace(tmp_file, cache_file)
+
+    return compiled
@@ -0,0 +1,216 @@
+import shutil
+import tempfile
+import textwrap
+from decimal import Decimal
+from typing import Iterable
+
+from beancount.core import data, display_context
+from beancount.core.amount import Amount
+from beancount.parser import printer
+from beancount.utils.misc_utils import escape_string
+from beangulp.extract import DUPLICATE, HEADER, SECTION
+
+# sections are staged in memory up to this many characters, then on disk
+SPOOL_SIZE = 1 << 20
+
+# number formatter used by beancount's printer when no display context is given
+_format_number = display_context.DEFAULT_DISPLAY_CONTEXT.build(
+    precision=display_context.Precision.MOST_COMMON
+).format
+
+
+def _format_metadata(meta, prefix="  "):
+    lines = []
+
+    for key, value in meta.items():
+        if key in ("filename", "lineno") or key.startswith("__"):
+            continue
+
+        if not isinstance(value, str):
+            return None
+
+        lines.append('{}{}: "{}"\n'.format(prefix, key, escape_string(value)))
+
+    return "".join(lines)
+
+
+def _format_transaction(entry):
+    strings = []
+    if entry.payee:
+        strings.append('"{}"'.format(escape_string(entry.payee)))
+    if entry.narration:
+        strings.append('"{}"'.format(escape_string(entry.narration)))
+    elif entry.payee:
+        strings.append('""')
+
+    meta = _format_metadata(entry.meta)
+
+    if meta is None:
+        return None
+
+    accounts = []
+    positions = []
+
+    for posting in entry.postings:
+        units = posting.units
+
+        if (
+            posting.flag
+            or posting.meta
+            or posting.cost is not None
+            or posting.price is not None
+            or not isinstance(units, Amount)
+            or not isinstance(units.number, Decimal)
+        ):
+            return None
+
+        accounts.append(posting.account)
+        positions.append(
+            "{} {}".format(_format_number(units.number, units.currency), units.currency)
+        )
+
+    width_account = max(map(len, accounts)) if accounts else 1
+    positions, width_position = printer.align_position_strings(positions)
+    width_position = max(1, width_position)
+
+    lines = [
+        "{} {} {}\n".format(
+            entry.date, printer.render_flag(entry.flag), " ".join(strings)
+        ),
+        meta,
+    ]
+
+    for account, position in zip(accounts, positions):
+        lines.append(
+            f"  {account:{width_account}}  {position:{width_position}}".rstrip() + "\n"
+        )
+
+    return "".join(lines)
+
+
+def _format_balance(entry):
+    amount = entry.amount
+
+    if (
+        entry.tolerance is not None
+        or entry.diff_amount
+        or not isinstance(amount.number, Decimal)
+    ):
+        return None
+
+    meta = _format_metadata(entry.meta)
+
+    if meta is None:
+        return None
+
+    return "{} balance {:47} {} {}\n{}".format(
+        entry.date,
+        entry.account,
+        _format_number(amount.number, amount.currency),
+        amount.currency,
+        meta,
+    )
+
+
+def format_entry(entry) -> str:
+    """Format `entry` exactly like `beancount.parser.printer.format_entry`.
+
+    Transactions without tags, links, costs, prices and posting metadata as
+    well as plain Balance directives (i.e. everything `ECImporter` produces)
+    are rendered directly; anything else is handed to beancount's printer.
+    """
+    string = None
+
+    if isinstance(entry, data.Transaction):
+        if not entry.tags and not entry.links:
+            string = _format_transaction(entry)
+    elif isinstance(entry, data.Balance):
+        string = _format_balance(entry)
+
+    if string is None:
+        string = printer.format_entry(entry)
+
+    return string
+
+
+class ExtractedWriter:
+    """Write extracted entries in the layout of `beangulp.extract`.
+
+    Entries are formatted as they arrive and written to `output` in chunks of
+    about `chunk_size` entries, so the full list of entries never has to exist
+    in memory. The output is identical to
+    `beangulp.extract.print_extracted_entries` for the same entries. Pass
+    ``header=False`` to leave out the header, e.g. when appending to a file
+    that already has one.
+
+    Each section is staged in a spooled temporary file and only copied to
+    `output` once all of its entries were formatted, so a file that fails
+    halfway through leaves nothing of its section behind.
+    """
+
+    def __init__(self, output, chunk_size: int = 1024, header: bool = True):
+        self.output = output
+        self.chunk_size = chunk_size
+
+        self._chunk = []
+        self._header_written = not header
+
+    def _write(self, string):
+        self._chunk.append(string)
+
+        if len(self._chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._chunk:
+            self.output.write("".join(self._chunk))
+            self._chunk.clear()
+
+    def write_section(self, filepath: str, entries: Iterable[data.Directive]):
+        """Write the section of `filepath`, or nothing if `entries` raises."""
+        self.flush()
+
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE, mode="w+") as spool:
+            staged = ExtractedWriter(
+                spool, self.chunk_size, header=not self._header_written
+            )
+            staged._write_section(filepath, entries)
+            staged.flush()
+
+            spool.seek(0)
+            shutil.copyfileobj(spool, self.output)
+
+        self._header_written = True
+
+    def _write_section(self, filepath: str, entries: Iterable[data.Directive]):
+        if not self._header_written:
+            self._write(HEADER + "\n")
+            self._header_written = True
+
+        self._write(SECTION.format(filepath) + "\n\n")
+
+        for entry in entries:
+            duplicate = entry.meta.pop(DUPLICATE, False)
+            string = format_entry(entry)
+
+            # same as beangulp: comment out duplicates, pointing to the original
+            if duplicate:
+                if isinstance(duplicate, type(entry)):
+                    filename = duplicate.meta.get("filename")
+                    lineno = duplicate.meta.get("lineno")
+                    if filename and lineno:
+                        self._write(f"; duplicate of {filename}:{lineno}\n")
+                string = textwrap.indent(string, "; ")
+
+            self._write(string + "\n")
+
+        self._write("\n")
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
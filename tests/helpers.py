@@ -0,0 +1,68 @@
+from textwrap import dedent
+
+from beancount_ing.ec import PRE_HEADER
+
+
+HEADER = ";".join(
+    '"{}"'.format(field)
+    for field in (
+        "Buchung",
+        "Valuta",
+        "Auftraggeber/Empfänger",
+        "Buchungstext",
+        "Verwendungszweck",
+        "Saldo",
+        "Währung",
+        "Betrag",
+        "Währung",
+    )
+)
+
+EXPORT = """
+Umsatzanzeige;Datei erstellt am: 25.07.2018 12:00
+
+IBAN;{iban}
+Kontoname;Extra-Konto
+Bank;ING
+Kunde;{user}
+Zeitraum;{date_from} - {date_to}
+Saldo;5.000,00;EUR
+
+Sortierung;{sorting}
+
+{pre_header}
+
+{header}
+"""
+
+
+def format_export(
+    rows,
+    iban="DE99 9999 9999 9999 9999 99",
+    user="Max Mustermann",
+    date_from="01.06.2018",
+    date_to="30.06.2018",
+    sorting="Datum absteigend",
+):
+    """Return an ING export with the given data `rows` (lines without line
+    endings), encoded like the real thing. The first row is on line 15."""
+    content = dedent(EXPORT).format(
+        iban=iban,
+        user=user,
+        date_from=date_from,
+        date_to=date_to,
+        sorting=sorting,
+        pre_header=PRE_HEADER,
+        header=HEADER,
+    )
+
+    return (content.lstrip() + "".join(row + "\n" for row in rows)).encode(
+        "ISO-8859-1"
+    )
+
+
+def write_export(path, rows, **kwargs):
+    with open(path, "wb") as fd:
+        fd.write(format_export(rows, **kwargs))
+
+    return path
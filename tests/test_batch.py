@@ -0,0 +1,104 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from beancount.core.data import Balance
+from beangulp.extract import HEADER
+
+from beancount_ing.batch import BatchImport
+from beancount_ing.ec import ECImporter
+from beancount_ing.writer import format_entry
+
+from helpers import write_export
+
+
+class BatchImportTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.importer = ECImporter(
+            "DE99999999999999999999",
+            "Assets:ING:Extra",
+            "Max Mustermann",
+            import_rules=[((None, None, "Expenses:Groceries"), ("rewe",), ())],
+        )
+
+        self.filenames = []
+
+        # files in reverse chronological order, rows sorted descending
+        for month in (3, 2, 1):
+            filename = write_export(
+                os.path.join(self.directory, f"{month}.csv"),
+                [
+                    f"{day:02}.{month:02}.2018;{day:02}.{month:02}.2018;"
+                    f"{'REWE' if day % 2 else 'LIDL'};Lastschrift;Einkauf {day};"
+                    f"1.000,00;EUR;-{day},00;EUR"
+                    for day in range(28, 0, -1)
+                ],
+                date_from=f"01.{month:02}.2018",
+                date_to=f"28.{month:02}.2018",
+            )
+
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+        super().tearDown()
+
+    def _expected(self):
+        entries = [
+            entry
+            for filename in self.filenames
+            for entry in self.importer.extract(filename)
+        ]
+        # all entries are on the same account: by date, balances first, then
+        # by source file and line
+        entries.sort(
+            key=lambda entry: (
+                entry.date,
+                not isinstance(entry, Balance),
+                entry.meta["filename"],
+                entry.meta["lineno"],
+            )
+        )
+
+        return HEADER + "\n" + "".join(format_entry(entry) + "\n" for entry in entries)
+
+    def _run(self, **kwargs):
+        output = io.StringIO()
+
+        with BatchImport(self.importer, tmpdir=self.directory, **kwargs) as batch:
+            batch.add_all(self.filenames)
+            runs = batch.runs
+            batch.write(output)
+
+        return output.getvalue(), runs
+
+    def test_in_memory(self):
+        output, runs = self._run()
+
+        self.assertEqual(runs, 0)
+        self.assertEqual(output, self._expected())
+
+    def test_spill_to_disk(self):
+        output, runs = self._run(max_memory=4096)
+
+        self.assertGreater(runs, 2)
+        self.assertEqual(output, self._expected())
+
+    def test_multi_pass_merge(self):
+        output, runs = self._run(max_memory=2048, max_open_runs=2)
+
+        self.assertGreater(runs, 4)
+        self.assertEqual(output, self._expected())
+
+    def test_temporary_files_removed(self):
+        self._run(max_memory=2048)
+
+        self.assertEqual(
+            sorted(os.listdir(self.directory)), ["1.csv", "2.csv", "3.csv"]
+        )
@@ -0,0 +1,177 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import date
+from unittest import TestCase
+
+from beancount.core.number import Decimal
+
+from beancount_ing.catalog import (
+    Catalog,
+    account_summary,
+    coverage_gap,
+    read_export_info,
+)
+
+from helpers import write_export
+
+
+IBAN = "DE99 9999 9999 9999 9999 99"
+OTHER_IBAN = "DE11 1111 1111 1111 1111 11"
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.exports = os.path.join(self.directory, "exports")
+        os.mkdir(self.exports)
+
+        self.catalog = Catalog(os.path.join(self.directory, "catalog.sqlite3"))
+
+        self._write("jan.csv", IBAN, "01.01.2018", "31.01.2018")
+        self._write("feb.csv", IBAN, "01.02.2018", "28.02.2018")
+        self._write("feb-mar.csv", IBAN, "15.02.2018", "15.03.2018")
+        self._write("may.csv", IBAN, "01.05.2018", "31.05.2018")
+        self._write("other.csv", OTHER_IBAN, "01.01.2018", "31.12.2018")
+
+        with open(os.path.join(self.exports, "notes.txt"), "w") as fd:
+            fd.write("not an export\n")
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.directory)
+
+        super().tearDown()
+
+    def _write(self, name, iban, date_from, date_to):
+        return write_export(
+            os.path.join(self.exports, name),
+            [
+                f"{date_to};{date_to};REWE;Lastschrift;REWE;1.100,00;EUR;-100,00;EUR",
+                f'{date_to};{date_to};"REWE; Markt";Lastschrift;REWE;1.200,00;EUR;'
+                "-34,00;EUR",
+                f"{date_from};{date_from};LIDL;Lastschrift;LIDL;1.234,00;EUR;"
+                "-500,00;EUR",
+            ],
+            iban=iban,
+            date_from=date_from,
+            date_to=date_to,
+        )
+
+    def test_read_export_info(self):
+        info = read_export_info(os.path.join(self.exports, "jan.csv"))
+
+        self.assertEqual(info.iban, "DE99999999999999999999")
+        self.assertEqual(info.user, "Max Mustermann")
+        self.assertEqual(info.date_from, date(2018, 1, 1))
+        self.assertEqual(info.date_to, date(2018, 1, 31))
+        self.assertEqual(info.sorting, "Datum absteigend")
+        self.assertEqual(info.rows, 3)
+        self.assertEqual(info.first_saldo, "1100.00")
+        self.assertEqual(info.last_saldo, "1234.00")
+
+        self.assertIsNone(read_export_info(os.path.join(self.exports, "notes.txt")))
+
+    def test_scan_is_incremental(self):
+        self.assertEqual(self.catalog.scan([self.exports]), 6)
+        self.assertEqual(self.catalog.scan([self.exports]), 0)
+
+        path = self._write("jan.csv", IBAN, "01.01.2018", "30.01.2018")
+        os.utime(path, ns=(0, 0))
+
+        self.assertEqual(self.catalog.scan([self.exports]), 1)
+
+        os.remove(os.path.join(self.exports, "may.csv"))
+
+        self.assertEqual(self.catalog.scan([self.exports]), 0)
+        self.assertEqual(
+            [export.path for export in self.catalog.exports(IBAN)],
+            [
+                os.path.join(self.exports, name)
+                for name in ("jan.csv", "feb.csv", "feb-mar.csv")
+            ],
+        )
+
+    def test_accounts(self):
+        self.catalog.scan([self.exports])
+
+        self.assertEqual(
+            self.catalog.accounts(),
+            [
+                account_summary(
+                    "DE11111111111111111111",
+                    "Max Mustermann",
+                    1,
+                    date(2018, 1, 1),
+                    date(2018, 12, 31),
+                ),
+                account_summary(
+                    "DE99999999999999999999",
+                    "Max Mustermann",
+                    4,
+                    date(2018, 1, 1),
+                    date(2018, 5, 31),
+                ),
+            ],
+        )
+
+    def test_exports(self):
+        self.catalog.scan([self.exports])
+
+        exports = self.catalog.exports(IBAN, date(2018, 2, 20), date(2018, 3, 1))
+
+        self.assertEqual(
+            [os.path.basename(export.path) for export in exports],
+            ["feb.csv", "feb-mar.csv"],
+        )
+        self.assertEqual(exports[0].first_saldo, Decimal("1100.00"))
+
+    def test_gaps(self):
+        self.catalog.scan([self.exports])
+
+        self.assertEqual(
+            self.catalog.gaps(IBAN),
+            [coverage_gap(date(2018, 3, 16), date(2018, 4, 30))],
+        )
+        self.assertEqual(
+            self.catalog.gaps(IBAN, date(2017, 12, 1), date(2018, 6, 30)),
+            [
+                coverage_gap(date(2017, 12, 1), date(2017, 12, 31)),
+                coverage_gap(date(2018, 3, 16), date(2018, 4, 30)),
+                coverage_gap(date(2018, 6, 1), date(2018, 6, 30)),
+            ],
+        )
+        self.assertEqual(self.catalog.gaps(OTHER_IBAN), [])
+
+    def test_overlaps(self):
+        self.catalog.scan([self.exports])
+
+        overlaps = self.catalog.overlaps(IBAN)
+
+        self.assertEqual(len(overlaps), 1)
+        self.assertEqual(
+            (
+                os.path.basename(overlaps[0].first),
+                os.path.basename(overlaps[0].second),
+                overlaps[0].date_from,
+                overlaps[0].date_to,
+            ),
+            ("feb.csv", "feb-mar.csv", date(2018, 2, 15), date(2018, 2, 28)),
+        )
+
+    def test_outdated_catalog_is_rebuilt(self):
+        self.catalog.scan([self.exports])
+        self.catalog.close()
+
+        path = os.path.join(self.directory, "catalog.sqlite3")
+
+        with sqlite3.connect(path) as connection:
+            connection.execute("PRAGMA user_version = 0")
+
+        self.catalog = Catalog(path)
+
+        self.assertEqual(self.catalog.accounts(), [])
+        self.assertEqual(self.catalog.scan([self.exports]), 6)
@@ -0,0 +1,198 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+from beangulp import extract
+
+from beancount_ing.daemon import Daemon, query
+from beancount_ing.ec import ECImporter
+
+from helpers import format_export
+
+
+class DaemonTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.output_dir, "journal.beancount")
+        self.importer = ECImporter(
+            "DE99999999999999999999", "Assets:ING:Extra", "Max Mustermann"
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.output_dir)
+
+        super().tearDown()
+
+    def _write_export(self, name, content=None):
+        if content is None:
+            content = format_export(
+                [
+                    "08.06.2018;08.06.2018;REWE Filialen Voll;Gutschrift;"
+                    "REWE SAGT DANKE;1.234,00;EUR;-500,00;EUR"
+                ],
+                sorting="Datum aufsteigend",
+            )
+        else:
+            content = content.encode("ISO-8859-1")
+
+        with open(os.path.join(self.directory, name), "wb") as fd:
+            fd.write(content)
+
+    def test_existing_files_are_skipped(self):
+        self._write_export("old.csv")
+
+        daemon = Daemon(self.importer, self.directory, output=self.journal)
+
+        self.assertEqual(daemon.run_once(), 0)
+        self.assertEqual(daemon.run_once(), 0)
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_new_files_are_appended_once_stable(self):
+        daemon = Daemon(self.importer, self.directory, output=self.journal)
+
+        self._write_export("new.csv")
+        self._write_export("unrelated.txt", "hello")
+
+        # first scan only observes the files, the second one processes them
+        self.assertEqual(daemon.run_once(), 0)
+        self.assertEqual(daemon.run_once(), 2)
+        self.assertEqual(daemon.run_once(), 0)
+
+        with open(self.journal) as fd:
+            journal = fd.read()
+
+        self.assertIn(
+            '2018-06-08 * "REWE Filialen Voll" "Gutschrift REWE SAGT DANKE"', journal
+        )
+        self.assertIn("2018-06-01 balance Assets:ING:Extra", journal)
+
+        status = daemon.status()
+
+        self.assertEqual(status["files_seen"], 2)
+        self.assertEqual(status["files_identified"], 1)
+        self.assertEqual(status["files_extracted"], 1)
+        self.assertEqual(status["entries_extracted"], 3)
+
+    def test_header_is_written_once(self):
+        daemon = Daemon(self.importer, self.directory, output=self.journal)
+
+        self._write_export("first.csv")
+        self._write_export("second.csv")
+
+        self.assertEqual(
+            daemon.run_once(
+                ready=tuple(
+                    os.path.join(self.directory, name)
+                    for name in ("first.csv", "second.csv")
+                )
+            ),
+            2,
+        )
+
+        with open(self.journal) as fd:
+            journal = fd.read()
+
+        self.assertTrue(journal.startswith(extract.HEADER))
+        self.assertEqual(journal.count(extract.HEADER), 1)
+        self.assertEqual(journal.count("2018-06-08 *"), 2)
+
+    def test_missing_trailing_newline(self):
+        with open(self.journal, "w") as fd:
+            fd.write("2018-01-01 open Assets:ING:Extra")
+
+        daemon = Daemon(self.importer, self.directory, output=self.journal)
+
+        self._write_export("new.csv")
+        path = os.path.join(self.directory, "new.csv")
+
+        self.assertEqual(daemon.run_once(ready=(path,)), 1)
+
+        with open(self.journal) as fd:
+            lines = fd.read().splitlines()
+
+        self.assertEqual(lines[0], "2018-01-01 open Assets:ING:Extra")
+        self.assertEqual(lines.count(f"**** {path}"), 1)
+
+    def test_failed_files_are_retried(self):
+        daemon = Daemon(self.importer, self.directory, output=self.journal)
+
+        self._write_export("new.csv")
+        path = os.path.join(self.directory, "new.csv")
+
+        with mock.patch.object(daemon, "_write", side_effect=OSError("disk full")):
+            self.assertEqual(daemon.run_once(ready=(path,)), 1)
+
+        self.assertFalse(os.path.exists(self.journal))
+        self.assertEqual(daemon.status()["files_failed"], 1)
+
+        self.assertEqual(daemon.run_once(ready=(path,)), 1)
+        self.assertEqual(daemon.run_once(ready=(path,)), 0)
+
+        with open(self.journal) as fd:
+            self.assertEqual(fd.read().count("2018-06-08 *"), 1)
+
+    def test_ready_files_skip_stability_check(self):
+        daemon = Daemon(self.importer, self.directory, output_dir=self.output_dir)
+
+        self._write_export("new.csv")
+        path = os.path.join(self.directory, "new.csv")
+
+        self.assertEqual(daemon.run_once(ready=(path,)), 1)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.output_dir, "new.csv.beancount"))
+        )
+
+    def test_insert_into_journal(self):
+        with open(self.journal, "w") as fd:
+            fd.write('2018-05-31 note Assets:ING:Extra "before"\n\n')
+            fd.write('2018-07-01 note Assets:ING:Extra "after"\n')
+
+        daemon = Daemon(self.importer, self.directory, output=self.journal, insert=True)
+
+        self._write_export("new.csv")
+        path = os.path.join(self.directory, "new.csv")
+
+        self.assertEqual(daemon.run_once(ready=(path,)), 1)
+
+        with open(self.journal) as fd:
+            journal = fd.read()
+
+        self.assertLess(journal.index('"before"'), journal.index("2018-06-01 balance"))
+        self.assertLess(journal.index("2018-06-08 *"), journal.index('"after"'))
+
+    def test_control_socket(self):
+        socket_path = os.path.join(self.output_dir, "control.sock")
+        daemon = Daemon(
+            self.importer,
+            self.directory,
+            output=self.journal,
+            interval=0.01,
+            socket_path=socket_path,
+        )
+
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+
+        try:
+            for _ in range(100):
+                if os.path.exists(socket_path):
+                    break
+                threading.Event().wait(0.01)
+
+            status = query(socket_path, "status")
+            self.assertEqual(status["files_seen"], 0)
+            self.assertEqual(status["directory"], self.directory)
+
+            self.assertEqual(query(socket_path, "stop"), {"stopping": True})
+        finally:
+            daemon.stop()
+            thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(socket_path))
@@ -1,30 +1,27 @@
+import asyncio
 import datetime
 from decimal import Decimal
 from tempfile import gettempdir
 from textwrap import dedent
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 import os
+import importlib.util
+import threading
+import time
+import warnings
 from datetime import date
 
 from beancount.core.data import Balance, Transaction
-from beancount_ing.ec import BANKS, ECImporter, PRE_HEADER
-
-
-HEADER = ";".join(
-    '"{}"'.format(field)
-    for field in (
-        "Buchung",
-        "Valuta",
-        "Auftraggeber/Empfänger",
-        "Buchungstext",
-        "Verwendungszweck",
-        "Saldo",
-        "Währung",
-        "Betrag",
-        "Währung",
-    )
+from beancount_ing.ec import (
+    BANKS,
+    ECImporter,
+    ExtractCancelled,
+    InvalidFormatError,
+    PRE_HEADER,
 )
 
+from helpers import HEADER
+
 
 def path_for_temp_file(name):
     return os.path.join(gettempdir(), name)
@@ -168,6 +165,22 @@ class ECImporterTestCase(TestCase):
 
         self.assertFalse(importer.identify(self.filename))
 
+    def test_identify_truncated_header(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        with open(self.filename, "wb") as fd:
+            fd.write(
+                self._format_data(
+                    """
+                    Umsatzanzeige;Datei erstellt am: 25.07.2018 12:00
+
+                    IBAN;{formatted_iban}
+                    """
+                )
+            )
+
+        self.assertFalse(importer.identify(self.filename))
+
     def test_extract_no_transactions(self):
         importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
 
@@ -561,3 +574,605 @@ class ECImporterTestCase(TestCase):
         self.assertEqual(directives[5].date, date(2018, 7, 1))
         self.assertEqual(directives[5].amount.number, 1000.0)
         self.assertEqual(directives[5].amount.currency, "EUR")
+
+    def test_mmap_parser_matches_csv_parser(self):
+        with open(self.filename, "wb") as fd:
+            fd.write(
+                self._format_data(
+                    """
+                    Umsatzanzeige;Datei erstellt am: 25.07.2018 12:00
+
+                    IBAN;{formatted_iban}
+                    Kontoname;Extra-Konto
+                    Bank;ING
+                    Kunde;{user}
+                    Zeitraum;01.06.2018 - 30.06.2018
+                    Saldo;5.000,00;EUR
+
+                    Sortierung;Datum absteigend
+
+                    {pre_header}
+
+                    "Buchung";"Valuta";"Auftraggeber/Empfänger";"Buchungstext";"Kategorie";"Verwendungszweck";"Saldo";"Währung";"Betrag";"Währung"
+                    15.06.2018;08.06.2018;LIDL;Lastschrift;Kategorie;LIDL SAGT DANKE;1.000,00;EUR;-100,00;EUR
+                    15.06.2018;08.06.2018;Bäckerei;Lastschrift;Kategorie;"Brötchen; Kaffee";1.100,00;EUR;-100,00;EUR
+                    08.06.2018;08.06.2018;LIDL;Lastschrift;Kategorie;LIDL SAGT DANKE;1.200,00;EUR;-34,00;EUR
+                    08.06.2018;08.06.2018;REWE Filialen Voll;Gutschrift;Kategorie;REWE SAGT DANKE;1.234,00;EUR;-500,00;EUR
+                    """  # NOQA
+                )
+            )
+
+        csv_directives = ECImporter(
+            self.iban, "Assets:ING:Extra", self.user
+        ).extract(self.filename)
+        mmap_directives = ECImporter(
+            self.iban, "Assets:ING:Extra", self.user, parser="mmap"
+        ).extract(self.filename)
+
+        self.assertEqual(len(mmap_directives), 4 + 2)
+        self.assertEqual(mmap_directives, csv_directives)
+        self.assertEqual(mmap_directives[1].payee, "Bäckerei")
+        self.assertEqual(
+            mmap_directives[1].narration, "Lastschrift Brötchen; Kaffee"
+        )
+
+    def test_mmap_parser_crlf_line_endings(self):
+        with open(self.filename, "wb") as fd:
+            fd.write(
+                self._format_data(
+                    """
+                    Umsatzanzeige;Datei erstellt am: 25.07.2018 12:00
+
+                    IBAN;{formatted_iban}
+                    Kontoname;Extra-Konto
+                    Bank;ING
+                    Kunde;{user}
+                    Zeitraum;01.06.2018 - 30.06.2018
+                    Saldo;5.000,00;EUR
+
+                    Sortierung;Datum aufsteigend
+
+                    {pre_header}
+
+                    {header}
+                    08.06.2018;08.06.2018;REWE Filialen Voll;Gutschrift;REWE SAGT DANKE;1.234,00;EUR;-500,00;EUR
+                    """  # NOQA
+                ).replace(b"\n", b"\r\n")
+            )
+
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user, parser="mmap")
+
+        directives = importer.extract(self.filename)
+
+        self.assertEqual(len(directives), 1 + 2)
+        self.assertEqual(directives[0].postings[0].units.currency, "EUR")
+        self.assertEqual(directives[0].postings[0].units.number, Decimal("-500.00"))
+        self.assertEqual(directives[1].amount.number, Decimal("1734.00"))
+        self.assertEqual(directives[2].amount.number, Decimal("1234.00"))
+
+    def test_unknown_parser(self):
+        with self.assertRaises(ValueError):
+            ECImporter(self.iban, "Assets:ING:Extra", self.user, parser="nope")
+
+    def _write_single_transaction(self):
+        with open(self.filename, "wb") as fd:
+            fd.write(
+                self._format_data(
+                    """
+                    Umsatzanzeige;Datei erstellt am: 25.07.2018 12:00
+
+                    IBAN;{formatted_iban}
+                    Kontoname;Extra-Konto
+                    Bank;ING
+                    Kunde;{user}
+                    Zeitraum;01.06.2018 - 30.06.2018
+                    Saldo;5.000,00;EUR
+
+                    {pre_header}
+
+                    {header}
+                    08.06.2018;08.06.2018;REWE Filialen Voll;Gutschrift;REWE SAGT DANKE;1.234,00;EUR;-500,00;EUR
+                    """  # NOQA
+                )
+            )
+
+    def test_import_rules(self):
+        self._write_single_transaction()
+
+        importer = ECImporter(
+            self.iban,
+            "Assets:ING:Extra",
+            self.user,
+            import_rules=[
+                (("REWE", "Groceries", "Expenses:Groceries"), ("^rewe",), ()),
+            ],
+        )
+
+        directives = importer.extract(self.filename)
+
+        self.assertEqual(directives[0].payee, "REWE")
+        self.assertEqual(directives[0].narration, "Groceries")
+        self.assertEqual(directives[0].meta["original_payee"], "REWE Filialen Voll")
+        self.assertEqual(directives[0].postings[1].account, "Expenses:Groceries")
+        self.assertEqual(directives[0].postings[1].units.number, Decimal("500.00"))
+
+    def test_import_rules_invalid_pattern(self):
+        self._write_single_transaction()
+
+        with self.assertRaises(ValueError):
+            ECImporter(
+                self.iban,
+                "Assets:ING:Extra",
+                self.user,
+                import_rules=[((None, None, None), ("(",), ())],
+            )
+
+    def test_import_rules_pathological_pattern_reported(self):
+        self._write_single_transaction()
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            importer = ECImporter(
+                self.iban,
+                "Assets:ING:Extra",
+                self.user,
+                import_rules=[
+                    ((None, None, None), ("rewe",), ()),
+                    ((None, None, None), (), ("(a+)+$",)),
+                ],
+                regex_check_budget=0.01,
+            )
+
+        messages = [str(warning.message) for warning in caught]
+
+        self.assertEqual(len(messages), 1)
+        self.assertIn("(a+)+$", messages[0])
+
+        # checked when the importer is created, not again on extract
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            importer.extract(self.filename)
+
+        self.assertEqual(caught, [])
+
+    @skipUnless(importlib.util.find_spec("regex"), "regex is not installed")
+    def test_import_rules_regex_backend(self):
+        self._write_single_transaction()
+
+        importer = ECImporter(
+            self.iban,
+            "Assets:ING:Extra",
+            self.user,
+            import_rules=[((None, "Groceries", None), (), ("sagt danke$",))],
+            regex_backend="regex",
+            regex_timeout=1.0,
+        )
+
+        directives = importer.extract(self.filename)
+
+        self.assertEqual(directives[0].narration, "Groceries")
+
+    def test_unknown_regex_backend(self):
+        with self.assertRaises(ValueError):
+            ECImporter(self.iban, "Assets:ING:Extra", self.user, regex_backend="pcre")
+
+    def test_rule_stats(self):
+        self._write_single_transaction()
+
+        importer = ECImporter(
+            self.iban,
+            "Assets:ING:Extra",
+            self.user,
+            import_rules=[
+                ((None, None, None), ("lidl",), ("lidl",)),
+                (("REWE", None, None), (), ("^gutschrift rewe",)),
+                (("Unreachable", None, None), ("rewe",), ()),
+            ],
+            collect_rule_stats=True,
+        )
+
+        importer.extract(self.filename)
+        importer.extract(self.filename)
+
+        stats = importer.rule_stats()
+
+        self.assertEqual(
+            [
+                (stat.rule_index, stat.kind, stat.pattern, stat.evaluations, stat.matches)
+                for stat in stats
+            ],
+            [
+                (0, "payee", "lidl", 2, 0),
+                (0, "description", "lidl", 2, 0),
+                (1, "description", "^gutschrift rewe", 2, 2),
+                (2, "payee", "rewe", 0, 0),
+            ],
+        )
+        self.assertTrue(all(stat.seconds >= 0 for stat in stats))
+
+        importer.reset_rule_stats()
+
+        self.assertEqual(sum(stat.evaluations for stat in importer.rule_stats()), 0)
+
+    def test_rule_stats_disabled(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        with self.assertRaises(ValueError):
+            importer.rule_stats()
+
+    def _write_many_transactions(self, count):
+        rows = "".join(
+            "08.06.2018;08.06.2018;REWE;Gutschrift;REWE SAGT DANKE;1.234,00;EUR;-1,00;EUR\n"  # NOQA
+            for _ in range(count)
+        )
+
+        with open(self.filename, "wb") as fd:
+            fd.write(
+                self._format_data(
+                    """
+                    Umsatzanzeige;Datei erstellt am: 25.07.2018 12:00
+
+                    IBAN;{formatted_iban}
+                    Kontoname;Extra-Konto
+                    Bank;ING
+                    Kunde;{user}
+                    Zeitraum;01.06.2018 - 30.06.2018
+                    Saldo;5.000,00;EUR
+
+                    {pre_header}
+
+                    {header}
+                    """  # NOQA
+                )
+                + rows.encode("ISO-8859-1")
+            )
+
+    def test_extract_progress(self):
+        self._write_many_transactions(25)
+
+        for parser in ("csv", "mmap"):
+            importer = ECImporter(
+                self.iban, "Assets:ING:Extra", self.user, parser=parser
+            )
+            reports = []
+
+            directives = importer.extract(
+                self.filename, progress=reports.append, progress_interval=10
+            )
+
+            self.assertEqual(len(directives), 25)
+            self.assertEqual([report.rows for report in reports], [10, 20, 25])
+            self.assertEqual(reports[-1].bytes, os.path.getsize(self.filename))
+            self.assertTrue(all(report.elapsed >= 0 for report in reports))
+
+    def test_extract_cancel(self):
+        self._write_many_transactions(25)
+
+        for parser in ("csv", "mmap"):
+            importer = ECImporter(
+                self.iban, "Assets:ING:Extra", self.user, parser=parser
+            )
+            cancel = threading.Event()
+
+            def progress(report):
+                if report.rows >= 20:
+                    cancel.set()
+
+            with self.assertRaises(ExtractCancelled) as context:
+                importer.extract(
+                    self.filename,
+                    progress=progress,
+                    cancel=cancel,
+                    progress_interval=10,
+                )
+
+            self.assertEqual(context.exception.reason, "cancelled")
+            self.assertEqual(context.exception.progress.rows, 20)
+
+    def test_extract_deadline(self):
+        self._write_many_transactions(25)
+
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        with self.assertRaises(ExtractCancelled) as context:
+            importer.extract(
+                self.filename, deadline=time.monotonic(), progress_interval=10
+            )
+
+        self.assertEqual(context.exception.reason, "deadline")
+        self.assertEqual(context.exception.progress.rows, 10)
+
+    def _write_saldo_chain(self, sorting, rows):
+        with open(self.filename, "wb") as fd:
+            fd.write(
+                self._format_data(
+                    """
+                    Umsatzanzeige;Datei erstellt am: 25.07.2018 12:00
+
+                    IBAN;{formatted_iban}
+                    Kontoname;Extra-Konto
+                    Bank;ING
+                    Kunde;{user}
+                    Zeitraum;01.06.2018 - 30.06.2018
+                    Saldo;5.000,00;EUR
+
+                    Sortierung;{sorting}
+
+                    {pre_header}
+
+                    {header}
+                    """,  # NOQA
+                    sorting=sorting,
+                )
+                + "".join(
+                    f"08.06.2018;08.06.2018;LIDL;Lastschrift;LIDL;{saldo};EUR;{amount};EUR\n"  # NOQA
+                    for saldo, amount in rows
+                ).encode("ISO-8859-1")
+            )
+
+    def test_saldo_chain_ascending(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        self._write_saldo_chain(
+            "Datum aufsteigend",
+            [
+                ("1.234,00", "-500,00"),
+                ("1.200,00", "-34,00"),
+                ("1.100,00", "-100,00"),
+                ("1.000,00", "-100,00"),
+                ("1.000,01", "0,01"),
+            ],
+        )
+
+        self.assertEqual(importer.check_saldo_chain(self.filename), [])
+
+        # third row missing, fourth row duplicated
+        self._write_saldo_chain(
+            "Datum aufsteigend",
+            [
+                ("1.234,00", "-500,00"),
+                ("1.200,00", "-34,00"),
+                ("1.000,00", "-100,00"),
+                ("1.000,00", "-100,00"),
+                ("1.000,01", "0,01"),
+            ],
+        )
+
+        breaks = importer.check_saldo_chain(self.filename)
+
+        self.assertEqual([b.lineno for b in breaks], [17, 18])
+        self.assertEqual(breaks[0].expected, Decimal("1100.00"))
+        self.assertEqual(breaks[0].actual, Decimal("1000.00"))
+        self.assertEqual(breaks[1].expected, Decimal("900.00"))
+
+    def test_saldo_chain_descending(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        self._write_saldo_chain(
+            "Datum absteigend",
+            [
+                ("1.000,00", "-100,00"),
+                ("1.100,00", "-100,00"),
+                ("1.200,00", "-34,00"),
+                ("1.234,00", "-500,00"),
+            ],
+        )
+
+        self.assertEqual(importer.check_saldo_chain(self.filename), [])
+
+        self._write_saldo_chain(
+            "Datum absteigend",
+            [
+                ("1.000,00", "-100,00"),
+                ("1.200,00", "-34,00"),
+                ("1.234,00", "-500,00"),
+            ],
+        )
+
+        breaks = importer.check_saldo_chain(self.filename)
+
+        self.assertEqual(len(breaks), 1)
+        self.assertEqual(breaks[0].lineno, 16)
+        self.assertEqual(breaks[0].expected, Decimal("1100.00"))
+        self.assertEqual(breaks[0].actual, Decimal("1200.00"))
+
+    def test_saldo_chain_malformed_row(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        self._write_saldo_chain(
+            "Datum aufsteigend",
+            [("1.234,00", "-500,00"), ("1.200,00", "-34,001")],
+        )
+
+        with self.assertRaisesRegex(InvalidFormatError, r":16: Betrag: .* '-34,001'"):
+            importer.check_saldo_chain(self.filename)
+
+        self._write_saldo_chain("Datum aufsteigend", [("1.234,00", "-500,00")])
+
+        with open(self.filename, "ab") as fd:
+            fd.write(b"08.06.2018;08.06.2018;LIDL;Lastschrift\n")
+
+        with self.assertRaisesRegex(InvalidFormatError, ":16: expected 9 fields"):
+            importer.check_saldo_chain(self.filename)
+
+    def test_saldo_chain_requires_date_sorting(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        self._write_saldo_chain("Betrag absteigend", [("1.000,00", "-100,00")])
+
+        with self.assertRaises(ValueError):
+            importer.check_saldo_chain(self.filename)
+
+    def test_validate(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        self._write_saldo_chain(
+            "Datum absteigend",
+            [("1.000,00", "-100,00"), ("1.100,00", "-100,00")],
+        )
+
+        self.assertEqual(importer.validate(self.filename), [])
+
+    def test_validate_collects_errors(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        with open(self.filename, "wb") as fd:
+            fd.write(
+                self._format_data(
+                    """
+                    Umsatzanzeige;Datei erstellt am: 25.07.2018 12:00
+
+                    IBAN;{formatted_iban}
+                    Kontoname;Extra-Konto
+                    Kunde;Erika Mustermann
+                    Zeitraum;01.06.2018
+                    Saldo;5.000,00;EUR
+
+                    {pre_header}
+
+                    {header}
+                    08.06.2018;08.06.2018;REWE;Lastschrift;REWE;1.000,00;EUR;-1,00;EUR
+                    31.06.2018;08.06.2018;REWE;Lastschrift;REWE;1.000,00;EUR;-1,00;EUR
+                    08.06.2018;08.06.2018;REWE;Lastschrift;REWE;1.000,00;EUR;-1,0x;EUR
+                    08.06.2018;08.06.2018;"REWE;Markt";Lastschrift;REWE;1,000;EUR;-1,00;EUR
+                    08.06.2018;08.06.2018;REWE;Lastschrift;REWE;1.000,00;EUR
+
+                    08.06.2018;08.06.2018;REWE;Lastschrift;REWE;1.000,00;EUR;-1,00;EUR
+                    """  # NOQA
+                )
+            )
+
+        errors = importer.validate(self.filename)
+
+        self.assertEqual(
+            [(error.lineno, error.message) for error in errors],
+            [
+                (5, "Kunde 'Erika Mustermann' does not match 'Max Mustermann'"),
+                (6, "Zeitraum: expected DD.MM.YYYY - DD.MM.YYYY, got '01.06.2018'"),
+                (8, "missing account information: Bank"),
+                (13, "invalid date '31.06.2018'"),
+                (14, "Betrag: expected an amount (e.g. -1.234,56), got '-1,0x'"),
+                (15, "Saldo: expected an amount (e.g. -1.234,56), got '1,000'"),
+                (16, "expected 9 fields, got 7"),
+                (17, "empty line in the data section"),
+            ],
+        )
+
+        self.assertEqual(len(importer.validate(self.filename, max_errors=3)), 3)
+
+    def test_validate_header_layout(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        with open(self.filename, "wb") as fd:
+            fd.write(
+                self._format_data(
+                    """
+                    Umsatzanzeige;Datei erstellt am: 25.07.2018 12:00
+                    IBAN;{formatted_iban}
+                    Kontoname;Extra-Konto
+                    Bank;ING
+                    Kunde;{user}
+                    Zeitraum;01.06.2018 - 30.06.2018
+                    Saldo;5.000,00;EUR
+                    Konto;Extra
+                    "Buchung";"Valuta";"Auftraggeber/Empfänger";"Buchungstext";"Betrag";"Währung"
+                    08.06.2018;08.06.2018;REWE;Lastschrift;-1,00;EUR
+                    """  # NOQA
+                )
+            )
+
+        self.assertEqual(
+            [(error.lineno, error.message) for error in importer.validate(self.filename)],
+            [
+                (2, "expected an empty line in front of the account information"),
+                (8, "unknown account information 'Konto'"),
+                (9, "missing pre-header line"),
+                (9, "missing columns: Verwendungszweck, Saldo, Währung_2"),
+            ],
+        )
+
+    def test_validate_not_an_export(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        with open(self.filename, "wb") as fd:
+            fd.write(b"not an ING export\n")
+
+        self.assertEqual(
+            importer.validate(self.filename),
+            [(1, "not an ING export: invalid first header line")],
+        )
+
+    def test_async_api(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        filenames = []
+
+        for index in range(6):
+            self._write_many_transactions(index + 1)
+            filename = path_for_temp_file(f"{self.iban}-{index}.csv")
+            os.replace(self.filename, filename)
+            filenames.append(filename)
+
+        async def run():
+            identified = await asyncio.gather(
+                *(importer.aidentify(filename) for filename in filenames)
+            )
+            single = await importer.aextract(filenames[0])
+            many = [
+                result
+                async for result in importer.aextract_many(
+                    filenames, max_concurrency=2
+                )
+            ]
+
+            return identified, single, many
+
+        try:
+            identified, single, many = asyncio.run(run())
+
+            self.assertEqual(identified, [True] * 6)
+            self.assertEqual(single, importer.extract(filenames[0]))
+            self.assertEqual(
+                dict(many),
+                {filename: importer.extract(filename) for filename in filenames},
+            )
+        finally:
+            for filename in filenames:
+                os.remove(filename)
+
+    def test_async_rule_stats(self):
+        self._write_single_transaction()
+
+        importer = ECImporter(
+            self.iban,
+            "Assets:ING:Extra",
+            self.user,
+            import_rules=[(("REWE", None, None), (), ("^gutschrift rewe",))],
+            collect_rule_stats=True,
+        )
+
+        async def run():
+            return [
+                result
+                async for result in importer.aextract_many(
+                    [self.filename] * 8, max_concurrency=4
+                )
+            ]
+
+        asyncio.run(run())
+
+        (stat,) = importer.rule_stats()
+
+        self.assertEqual((stat.evaluations, stat.matches), (8, 8))
+
+    def test_async_extract_many_propagates_errors(self):
+        importer = ECImporter(self.iban, "Assets:ING:Extra", self.user)
+
+        with open(self.filename, "wb") as fd:
+            fd.write(b"not an ING export\n")
+
+        async def run():
+            return [result async for result in importer.aextract_many([self.filename])]
+
+        with self.assertRaises(InvalidFormatError):
+            asyncio.run(run())
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+from datetime import date
+from decimal import Decimal
+from unittest import TestCase, skipUnless
+
+from beancount_ing import export
+from beancount_ing.ec import ECImporter
+
+from helpers import write_export
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.importer = ECImporter(
+            "DE99999999999999999999",
+            "Assets:ING:Extra",
+            "Max Mustermann",
+            import_rules=[
+                ((None, None, "Expenses:Groceries"), ("rewe",), ()),
+                ((None, None, "Expenses:Rent"), (), ("miete",)),
+            ],
+        )
+
+        self.filename = write_export(
+            os.path.join(self.directory, "export.csv"),
+            [
+                f"{day:02}.01.2018;{day:02}.01.2018;"
+                f"{('REWE', 'LIDL', 'Vermieter')[day % 3]};Lastschrift;"
+                f"{'Miete' if day % 3 == 2 else 'Einkauf'} {day};"
+                f"1.{day:03},00;EUR;-{day},{day:02};EUR"
+                for day in range(28, 0, -1)
+            ],
+            date_from="01.01.2018",
+            date_to="28.01.2018",
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+        super().tearDown()
+
+    def test_iter_rows(self):
+        rows = list(self.importer.iter_rows(self.filename))
+
+        self.assertEqual(len(rows), 28)
+
+        row = rows[0]
+
+        # physical line of the row in the file
+        self.assertEqual(row.lineno, 15)
+        self.assertEqual(row.booking_date, date(2018, 1, 28))
+        self.assertEqual(row.payee, "LIDL")
+        self.assertEqual(row.purpose, "Einkauf 28")
+        self.assertEqual(row.amount, Decimal("-28.28"))
+        self.assertEqual(row.saldo, Decimal("1028.00"))
+        self.assertIsNone(row.rule)
+
+    def test_rule_matches_extract(self):
+        accounts = {
+            None: None,
+            0: "Expenses:Groceries",
+            1: "Expenses:Rent",
+        }
+
+        # every row has a distinct date and amount
+        transactions = {
+            (entry.date, entry.postings[0].units.number): entry
+            for entry in self.importer.extract(self.filename)
+            if hasattr(entry, "postings")
+        }
+
+        for row in self.importer.iter_rows(self.filename):
+            postings = transactions[row.booking_date, row.amount].postings
+            account = postings[1].account if len(postings) > 1 else None
+
+            self.assertEqual(accounts[row.rule], account, row)
+
+    @skipUnless(export.pyarrow, "pyarrow is not installed")
+    def test_parquet(self):
+        import pyarrow.parquet
+
+        path = self.importer.export(
+            [self.filename], os.path.join(self.directory, "rows.parquet")
+        )
+
+        table = pyarrow.parquet.read_table(path)
+
+        self.assertEqual(table.column_names, list(export.COLUMNS))
+        self.assertEqual(
+            table.to_pylist(),
+            [row._asdict() for row in self.importer.iter_rows(self.filename)],
+        )
+
+    @skipUnless(export.pyarrow, "pyarrow is not installed")
+    def test_arrow_in_batches(self):
+        import pyarrow.ipc
+
+        path = export.export_rows(
+            self.importer,
+            [self.filename, self.filename],
+            os.path.join(self.directory, "rows.arrow"),
+            batch_size=10,
+        )
+
+        with pyarrow.ipc.open_file(path) as reader:
+            self.assertEqual(reader.num_record_batches, 6)
+            table = reader.read_all()
+
+        rows = list(self.importer.iter_rows(self.filename))
+
+        self.assertEqual(table.to_pylist(), [row._asdict() for row in rows * 2])
+
+    @skipUnless(export.numpy, "numpy is not installed")
+    def test_npz(self):
+        import numpy
+
+        path = self.importer.export(
+            [self.filename], os.path.join(self.directory, "rows.npz")
+        )
+        rows = list(self.importer.iter_rows(self.filename))
+
+        with numpy.load(path) as arrays:
+            self.assertEqual(sorted(arrays.files), sorted(export.COLUMNS))
+            self.assertEqual(arrays["booking_date"].dtype, "datetime64[D]")
+            self.assertEqual(
+                arrays["amount"].tolist(),
+                [int(row.amount * 100) for row in rows],
+            )
+            self.assertEqual(
+                arrays["rule"].tolist(),
+                [-1 if row.rule is None else row.rule for row in rows],
+            )
+            self.assertEqual(arrays["payee"].tolist(), [row.payee for row in rows])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            self.importer.export(
+                [self.filename], os.path.join(self.directory, "rows"), format="csv"
+            )
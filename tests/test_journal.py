@@ -0,0 +1,234 @@
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from unittest import TestCase
+
+from beancount.core import data
+from beancount.core.amount import Amount
+from beancount.core.number import Decimal
+from beancount.parser import parser
+
+from beancount_ing.journal import (
+    JournalIndex,
+    _format_backup,
+    insert_entries,
+)
+from beancount_ing.writer import format_entry
+
+
+def _transaction(day, narration):
+    return data.Transaction(
+        data.new_metadata("journal", 0),
+        date(2018, 1, 1) + timedelta(days=day),
+        "*",
+        "REWE",
+        narration,
+        data.EMPTY_SET,
+        data.EMPTY_SET,
+        [
+            data.Posting(
+                "Assets:ING:Extra", Amount(Decimal("-1.00"), "EUR"), None, None, None, None
+            )
+        ],
+    )
+
+
+def _render(entries):
+    return "".join(format_entry(entry) + "\n" for entry in entries)
+
+
+class JournalIndexTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.journal = os.path.join(self.directory, "ing.beancount")
+
+        self.existing = [_transaction(day, f"old {day}") for day in range(0, 60, 2)]
+
+        with open(self.journal, "w") as fd:
+            fd.write('option "operating_currency" "EUR"\n\n')
+            fd.write(_render(self.existing))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+        super().tearDown()
+
+    def _read(self):
+        with open(self.journal) as fd:
+            return fd.read()
+
+    def _narrations(self):
+        entries, errors, _ = parser.parse_string(self._read())
+
+        self.assertEqual(errors, [])
+
+        return [entry.narration for entry in entries]
+
+    def test_index(self):
+        index = JournalIndex(self.journal)
+        index.refresh()
+
+        self.assertEqual(index.dates, [entry.date for entry in self.existing])
+        self.assertTrue(os.path.exists(self.journal + ".idx"))
+
+        with open(self.journal, "rb") as fd:
+            fd.seek(index.position(date(2018, 1, 2)))
+
+            self.assertTrue(fd.readline().startswith(b"2018-01-03 * "))
+
+    def test_insert_sorted(self):
+        new = [
+            _transaction(61, "new 61"),
+            _transaction(1, "new 1"),
+            _transaction(-1, "new -1"),
+            _transaction(10, "new 10"),
+        ]
+
+        insert_entries(self.journal, new)
+
+        expected = sorted(self.existing + new, key=data.entry_sortkey)
+
+        self.assertEqual(
+            self._read(), 'option "operating_currency" "EUR"\n\n' + _render(expected)
+        )
+
+        # the refreshed index matches a fresh scan of the journal
+        os.remove(self.journal + ".idx")
+        refreshed = JournalIndex(self.journal)
+        refreshed.refresh()
+
+        self.assertEqual(
+            refreshed.dates,
+            sorted({entry.date for entry in expected}),
+        )
+
+    def test_insert_same_date_after_existing(self):
+        insert_entries(self.journal, [_transaction(4, "new 4")])
+
+        narrations = self._narrations()
+
+        self.assertEqual(narrations.index("new 4"), narrations.index("old 4") + 1)
+
+    def test_append_only_writes_new_entries(self):
+        new = [_transaction(100, "new 100")]
+
+        written = insert_entries(self.journal, new)
+
+        self.assertEqual(written, len(_render(new)))
+        self.assertEqual(self._narrations()[-1], "new 100")
+
+    def test_rewrites_only_tail(self):
+        size = os.path.getsize(self.journal)
+        index = JournalIndex(self.journal)
+        index.refresh()
+        tail = size - index.position(date(2018, 2, 25))
+
+        new = [_transaction(55, "new 55")]
+
+        self.assertEqual(index.insert(new), len(_render(new)) + tail)
+
+    def test_external_append_is_indexed_incrementally(self):
+        index = JournalIndex(self.journal)
+        index.refresh()
+
+        with open(self.journal, "a") as fd:
+            fd.write(_render([_transaction(80, "appended 80")]))
+
+        index.insert([_transaction(70, "new 70")])
+
+        self.assertEqual(self._narrations()[-2:], ["new 70", "appended 80"])
+
+    def test_external_rewrite_is_rescanned(self):
+        JournalIndex(self.journal).refresh()
+
+        with open(self.journal, "w") as fd:
+            fd.write(_render([_transaction(0, "old 0"), _transaction(9, "old 9")]))
+
+        insert_entries(self.journal, [_transaction(5, "new 5")])
+
+        self.assertEqual(self._narrations(), ["old 0", "new 5", "old 9"])
+
+    def test_comments_stay_with_their_entry(self):
+        with open(self.journal, "w") as fd:
+            fd.write(_render([_transaction(0, "old 0")]))
+            fd.write("; note\n")
+            fd.write(_render([_transaction(9, "old 9")]))
+
+        insert_entries(self.journal, [_transaction(5, "new 5")])
+
+        self.assertIn(
+            "\n\n; note\n" + format_entry(_transaction(9, "old 9")), self._read()
+        )
+        self.assertEqual(self._narrations(), ["old 0", "new 5", "old 9"])
+
+    def test_missing_trailing_newline(self):
+        with open(self.journal, "w") as fd:
+            fd.write(format_entry(_transaction(0, "old 0")).rstrip("\n"))
+
+        insert_entries(self.journal, [_transaction(5, "new 5")])
+
+        self.assertEqual(self._narrations(), ["old 0", "new 5"])
+
+    def test_new_journal(self):
+        journal = os.path.join(self.directory, "new.beancount")
+
+        insert_entries(journal, [_transaction(5, "new 5"), _transaction(0, "new 0")])
+
+        with open(journal) as fd:
+            self.assertEqual(
+                fd.read(), _render([_transaction(0, "new 0"), _transaction(5, "new 5")])
+            )
+
+    def test_recover_interrupted_insert(self):
+        with open(self.journal, "rb") as fd:
+            original = fd.read()
+
+        # simulate a crash after the tail was saved and partly overwritten
+        offset = len(original) // 2
+
+        with open(self.journal + ".tail", "wb") as fd:
+            fd.write(_format_backup(offset, original[offset:]))
+
+        with open(self.journal, "r+b") as fd:
+            fd.seek(offset)
+            fd.write(b"garbage")
+            fd.truncate()
+
+        with self.assertWarns(UserWarning):
+            JournalIndex(self.journal)
+
+        with open(self.journal, "rb") as fd:
+            self.assertEqual(fd.read(), original)
+
+        self.assertFalse(os.path.exists(self.journal + ".tail"))
+
+    def test_invalid_backup_is_not_applied(self):
+        with open(self.journal, "rb") as fd:
+            original = fd.read()
+
+        offset = len(original) // 2
+        backup = _format_backup(offset, original[offset:])
+
+        for invalid in (
+            b"",
+            b"garbage\n",
+            backup[:-10],
+            backup.replace(b"2018", b"2019"),
+            _format_backup(len(original) + 1, b"trailing"),
+        ):
+            with open(self.journal + ".tail", "wb") as fd:
+                fd.write(invalid)
+
+            with self.assertWarns(UserWarning):
+                JournalIndex(self.journal)
+
+            with open(self.journal, "rb") as fd:
+                self.assertEqual(fd.read(), original)
+
+            self.assertFalse(os.path.exists(self.journal + ".tail"))
+
+            with open(self.journal + ".tail.rejected", "rb") as fd:
+                self.assertEqual(fd.read(), invalid)
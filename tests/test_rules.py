@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import warnings
+from pathlib import Path
+from textwrap import dedent
+from unittest import TestCase, mock
+
+from beancount_ing import rules as rules_module
+from beancount_ing.ec import ECImporter
+from beancount_ing.rules import (
+    compile_import_rules,
+    compile_pattern,
+    import_rule,
+    load_import_rules,
+    worst_case_search_time,
+)
+
+
+def _patterns(rules):
+    return [
+        (
+            rule.replacements,
+            tuple(regex.pattern for regex in rule.payee_regexs),
+            tuple(regex.pattern for regex in rule.description_regexs),
+        )
+        for rule in rules
+    ]
+
+
+class LoadImportRulesTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.base_dir = Path(tempfile.mkdtemp())
+        self.cache_dir = self.base_dir / "cache"
+
+        with open(self.base_dir / "rules.toml", "w") as fd:
+            fd.write(
+                dedent(
+                    """
+                    [[import_rules]]
+                    payee = "LIDL"
+                    account = "Expenses:Groceries"
+                    payee_patterns = ["^lidl"]
+                    """
+                )
+            )
+
+        self.config = {
+            "rules_file": "rules.toml",
+            "import_rules": [
+                {
+                    "payee": "REWE",
+                    "narration": "Groceries",
+                    "payee_patterns": ["^rewe"],
+                    "description_patterns": ["rewe sagt danke"],
+                },
+            ],
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+        super().tearDown()
+
+    def test_inline_and_file_rules(self):
+        rules = load_import_rules(self.config, base_dir=self.base_dir)
+
+        self.assertTrue(all(isinstance(rule, import_rule) for rule in rules))
+        self.assertEqual(
+            _patterns(rules),
+            [
+                (("REWE", "Groceries", None), ("^rewe",), ("rewe sagt danke",)),
+                (("LIDL", None, "Expenses:Groceries"), ("^lidl",), ()),
+            ],
+        )
+
+    def test_cache(self):
+        rules = load_import_rules(
+            self.config, base_dir=self.base_dir, cache_dir=self.cache_dir
+        )
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        # a cache hit does not need to read the rules file again
+        self.assertEqual(
+            _patterns(
+                load_import_rules(
+                    self.config, base_dir=self.base_dir, cache_dir=self.cache_dir
+                )
+            ),
+            _patterns(rules),
+        )
+
+        # changing the rules file invalidates the cache
+        with open(self.base_dir / "rules.toml", "a") as fd:
+            fd.write('\n[[import_rules]]\ndescription_patterns = ["aldi"]\n')
+
+        rules = load_import_rules(
+            self.config, base_dir=self.base_dir, cache_dir=self.cache_dir
+        )
+
+        self.assertEqual(len(rules), 3)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_cached_warnings_are_repeated(self):
+        self.config["regex_check_budget"] = 0.01
+        self.config["import_rules"].append({"payee_patterns": ["(a+)+$"]})
+
+        for _ in range(2):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                load_import_rules(
+                    self.config, base_dir=self.base_dir, cache_dir=self.cache_dir
+                )
+
+            self.assertEqual(len(caught), 1)
+            self.assertIn("(a+)+$", str(caught[0].message))
+
+        (cache_file,) = self.cache_dir.iterdir()
+
+        self.assertEqual(len(json.loads(cache_file.read_text())["warnings"]), 1)
+
+    def test_rules_are_compiled_once(self):
+        for _ in range(2):
+            with mock.patch.object(
+                rules_module,
+                "compile_pattern",
+                wraps=rules_module.compile_pattern,
+            ) as compile_pattern:
+                rules = load_import_rules(
+                    self.config, base_dir=self.base_dir, cache_dir=self.cache_dir
+                )
+                ECImporter(
+                    "DE99999999999999999999",
+                    "Assets:ING:Extra",
+                    "Max Mustermann",
+                    import_rules=rules,
+                )
+
+            # three patterns, compiled once on a cache miss and once on a hit
+            self.assertEqual(compile_pattern.call_count, 3)
+
+    def test_invalid_rules(self):
+        with self.assertRaises(ValueError):
+            load_import_rules({"import_rules": [{"payee_patterns": ["("]}]})
+
+        with self.assertRaises(ValueError):
+            load_import_rules({"import_rules": [{"payee_regex": ["rewe"]}]})
+
+    def test_compile_import_rules(self):
+        (rule,) = compile_import_rules([((None, None, None), ("rewe",), ())])
+
+        self.assertTrue(rule.payee_regexs[0].search("REWE Filialen Voll"))
+        self.assertEqual(rule.description_regexs, ())
+
+
+class WorstCaseSearchTimeTestCase(TestCase):
+    def test_linear_pattern_within_budget(self):
+        elapsed = worst_case_search_time(compile_pattern("^rewe"), 1.0)
+
+        self.assertLess(elapsed, 1.0)
+
+    def test_budget_is_a_ceiling(self):
+        # the probe of length 24 alone takes seconds, and 32 takes minutes
+        start = time.perf_counter()
+        elapsed = worst_case_search_time(compile_pattern("(a+)+$"), 0.3)
+        total = time.perf_counter() - start
+
+        self.assertGreater(elapsed, 0.3)
+        self.assertLess(elapsed, 1.0)
+        self.assertLess(total, 3.0)
@@ -0,0 +1,132 @@
+import datetime
+import io
+from decimal import Decimal
+from unittest import TestCase
+
+from beancount.core import data, flags
+from beancount.core.amount import Amount
+from beancount.parser import printer
+from beangulp.extract import DUPLICATE, print_extracted_entries
+
+from beancount_ing.writer import ExtractedWriter, format_entry
+
+
+def _transaction(payee, narration, *numbers, meta=None, tags=data.EMPTY_SET):
+    postings = [
+        data.Posting(account, Amount(Decimal(number), "EUR"), None, None, None, None)
+        for account, number in zip(
+            ("Assets:ING:Extra", "Expenses:Groceries:Supermarket"), numbers
+        )
+    ]
+
+    return data.Transaction(
+        dict(data.new_metadata("file.csv", 12), **(meta or {})),
+        datetime.date(2018, 6, 8),
+        flags.FLAG_OKAY,
+        payee,
+        narration,
+        tags,
+        data.EMPTY_SET,
+        postings,
+    )
+
+
+def _balance(number, currency="EUR"):
+    return data.Balance(
+        data.new_metadata("file.csv", 13),
+        datetime.date(2018, 7, 1),
+        "Assets:ING:Extra",
+        Amount(Decimal(number), currency),
+        None,
+        None,
+    )
+
+
+ENTRIES = [
+    _transaction("REWE Filialen Voll", "Gutschrift REWE SAGT DANKE", "-500.00"),
+    _transaction("REWE", "", "-1234.5", "1234.5"),
+    _transaction(None, "Zinsen", "0.01"),
+    _transaction(None, "", "-3"),
+    _transaction(
+        'Bäckerei "Brot"',
+        "Lastschrift \\ Brötchen",
+        "-12.30",
+        "12.30",
+        meta={"original_payee": 'Bäckerei "Brot" GmbH', "original_narration": "x"},
+    ),
+    _transaction("LIDL", "Lastschrift", "-1000000.00", tags=frozenset({"food"})),
+    _transaction("LIDL", "Lastschrift", "-1", meta={"amount": Decimal("1")}),
+    _balance("1734.00"),
+    _balance("-0.50", "USD"),
+]
+
+
+class FormatEntryTestCase(TestCase):
+    def test_identical_to_printer(self):
+        for entry in ENTRIES:
+            self.assertEqual(format_entry(entry), printer.format_entry(entry))
+
+
+class ExtractedWriterTestCase(TestCase):
+    def test_identical_to_beangulp(self):
+        duplicate = ENTRIES[0]._replace(meta=dict(ENTRIES[0].meta))
+        duplicate.meta[DUPLICATE] = ENTRIES[1]
+
+        extracted = [
+            ("first.csv", ENTRIES, "Assets:ING:Extra", None),
+            ("empty.csv", [], "Assets:ING:Extra", None),
+            ("second.csv", [duplicate, *ENTRIES[1:3]], "Assets:ING:Extra", None),
+        ]
+
+        # both writers pop the duplicate marker, give each its own copies
+        def copy(extracted):
+            return [
+                (
+                    filepath,
+                    [entry._replace(meta=dict(entry.meta)) for entry in entries],
+                    account,
+                    importer,
+                )
+                for filepath, entries, account, importer in extracted
+            ]
+
+        expected = io.StringIO()
+        print_extracted_entries(copy(extracted), expected)
+
+        output = io.StringIO()
+
+        with ExtractedWriter(output, chunk_size=2) as writer:
+            for filepath, entries, _, _ in copy(extracted):
+                writer.write_section(filepath, iter(entries))
+
+        self.assertEqual(output.getvalue(), expected.getvalue())
+
+    def test_failed_section_is_not_written(self):
+        def entries():
+            yield ENTRIES[0]
+            raise ValueError("invalid date")
+
+        output = io.StringIO()
+
+        with ExtractedWriter(output) as writer:
+            with self.assertRaises(ValueError):
+                writer.write_section("broken.csv", entries())
+
+            self.assertEqual(output.getvalue(), "")
+
+            writer.write_section("first.csv", iter(ENTRIES))
+
+        expected = io.StringIO()
+        print_extracted_entries(
+            [("first.csv", ENTRIES, "Assets:ING:Extra", None)], expected
+        )
+
+        self.assertEqual(output.getvalue(), expected.getvalue())
+
+    def test_nothing_written(self):
+        output = io.StringIO()
+
+        with ExtractedWriter(output):
+            pass
+
+        self.assertEqual(output.getvalue(), "")